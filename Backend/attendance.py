@@ -0,0 +1,308 @@
+from datetime import datetime, timedelta, date
+from tortoise.expressions import Q
+from tortoise.functions import Count
+from tortoise.transactions import in_transaction
+from models import Employee, TimeLog, DailyAttendance
+from utils import convert_to_local, format_duration
+
+
+class DayState:
+    # IN/OUT pairing state machine for one employee-day.
+    # Feed it the day's events in timestamp order through apply().
+    def __init__(self):
+        self.entry_time = None
+        self.exit_time = None
+        self.in_time = 0
+        self.corrupted = False
+        self.inside = False
+        self.last_in = None
+
+    @classmethod
+    def from_row(cls, row: DailyAttendance):
+        state = cls()
+        state.entry_time = row.first_entry
+        state.exit_time = row.last_exit
+        state.in_time = row.in_seconds
+        state.corrupted = row.corrupted
+        state.inside = row.inside
+        state.last_in = row.last_in
+        return state
+
+    def store(self, row: DailyAttendance):
+        row.first_entry = self.entry_time
+        row.last_exit = self.exit_time
+        row.in_seconds = self.in_time
+        row.corrupted = self.corrupted
+        row.inside = self.inside
+        row.last_in = self.last_in
+        return row
+
+    def apply(self, timestamp, action):
+        if action == "IN":
+            if self.inside:
+                self.corrupted = True  # Two consecutive INs
+            else:
+                self.last_in = timestamp
+                self.inside = True
+                if not self.entry_time:
+                    self.entry_time = timestamp
+        elif action == "OUT":
+            if self.inside and self.last_in:
+                self.in_time += (timestamp - self.last_in).total_seconds()
+                self.exit_time = timestamp
+                self.inside = False
+                self.last_in = None
+            else:
+                self.corrupted = True  # OUT without prior IN
+
+    def summary(self, day: date, today: date):
+        entry_time = self.entry_time
+        exit_time = self.exit_time
+        corrupted = self.corrupted
+
+        # Handle unmatched IN (still inside)
+        if self.inside:
+            if day == today:
+                corrupted = False  # Allow it for today
+                exit_time = None  # Don't set lastExit if still inside
+            else:
+                corrupted = True
+
+        total_out_time = 0
+        if entry_time and exit_time and entry_time < exit_time:
+            total_span = (exit_time - entry_time).total_seconds()
+            total_out_time = total_span - self.in_time
+
+        return {
+            "date": day.strftime("%Y-%m-%d"),
+            "firstEntry": convert_to_local(entry_time).strftime("%I:%M %p") if entry_time else "-",
+            "lastExit": convert_to_local(exit_time).strftime("%I:%M %p") if exit_time else "-",  # will be "-" if still inside today
+            "totalInTime": format_duration(int(self.in_time)) if entry_time and exit_time else "-",
+            "totalOutTime": format_duration(int(total_out_time)) if entry_time and exit_time else "-",
+            "status": "Present" if entry_time and not corrupted else ("Absent" if not entry_time else "Corrupted")
+        }
+
+
+def as_stored(timestamp):
+    # The shape a TimeLog row holds the timestamp in, as built and as read
+    # back: converted to Tortoise's timezone when use_tz is on, else naive.
+    # MySQL DATETIME drops the offset (pymysql writes the wall-clock value),
+    # so a rollup field assigned any other shape would come back shifted.
+    return TimeLog._meta.fields_map["timestamp"].to_python_value(timestamp)
+
+
+def day_bounds(start_date: date, end_date: date):
+    # [start 00:00, end+1 00:00) in stored (local wall-clock) time
+    return (
+        datetime.combine(start_date, datetime.min.time()),
+        datetime.combine(end_date + timedelta(days=1), datetime.min.time()),
+    )
+
+
+def iter_days(start_date: date, end_date: date):
+    current = start_date
+    while current <= end_date:
+        yield current
+        current += timedelta(days=1)
+
+
+def bucket_by_day(logs):
+    # logs: (timestamp, action) ordered by timestamp.
+    # Timestamps are written as local wall-clock time by /enter and /exit,
+    # so the stored date is the local day (same boundaries day_bounds uses).
+    days = {}
+    for timestamp, action in logs:
+        state = days.get(timestamp.date())
+        if state is None:
+            state = days[timestamp.date()] = DayState()
+        state.apply(timestamp, action)
+    return days
+
+
+def timelog_range_query(employee_id: int, start_date: date, end_date: date):
+    start_dt, end_dt = day_bounds(start_date, end_date)
+    return TimeLog.filter(
+        employee_id=employee_id,
+        timestamp__gte=start_dt,
+        timestamp__lt=end_dt
+    ).order_by("timestamp", "id").values_list("timestamp", "action")
+
+
+def rollup_range_query(employee_id: int, start_date: date, end_date: date):
+    return DailyAttendance.filter(
+        employee_id=employee_id,
+        date__gte=start_date,
+        date__lte=end_date
+    )
+
+
+def present_ids_query(target_date: date):
+    # Employees with at least one "IN" log that day
+    start_dt, end_dt = day_bounds(target_date, target_date)
+    return TimeLog.filter(
+        action="IN",
+        timestamp__gte=start_dt,
+        timestamp__lt=end_dt
+    ).distinct().values_list("employee_id", flat=True)
+
+
+def present_counts_query(start_date: date, end_date: date):
+    # Present employees per day, grouped over the rollup
+    return DailyAttendance.filter(
+        date__gte=start_date,
+        date__lte=end_date,
+        first_entry__isnull=False
+    ).annotate(present=Count("id")).group_by("date").values("date", "present")
+
+
+async def record_event(employee_id: int, timestamp, action: str):
+    # Advance the employee's rollup row for the event's day by one event.
+    timestamp = as_stored(timestamp)
+    async with in_transaction():
+        row, _ = await DailyAttendance.get_or_create(employee_id=employee_id, date=timestamp.date())
+        # Lock the day so concurrent events for it apply one after the other
+        row = await DailyAttendance.select_for_update().get(id=row.id)
+        state = DayState.from_row(row)
+        state.apply(timestamp, action)
+        await state.store(row).save()
+
+
+async def rebuild_attendance(employee_id: int, start_date: date = None, end_date: date = None):
+    # Recompute the rollup rows of one employee from raw TimeLog history.
+    if start_date and end_date:
+        logs = timelog_range_query(employee_id, start_date, end_date)
+        rows = rollup_range_query(employee_id, start_date, end_date)
+    else:
+        logs = TimeLog.filter(employee_id=employee_id).order_by("timestamp", "id").values_list("timestamp", "action")
+        rows = DailyAttendance.filter(employee_id=employee_id)
+    days = bucket_by_day(await logs)
+
+    async with in_transaction():
+        await rows.delete()
+        await DailyAttendance.bulk_create([
+            state.store(DailyAttendance(employee_id=employee_id, date=day))
+            for day, state in days.items()
+        ])
+    return len(days)
+
+
+async def refresh_attendance(pairs):
+    # Recompute the rollup rows for a set of (employee_id, day) pairs from
+    # TimeLog, e.g. after a batch insert whose events may arrive out of order.
+    # Run it in the transaction that inserted the events.
+    if not pairs:
+        return 0
+    employee_ids = {employee_id for employee_id, _ in pairs}
+    first_day = min(day for _, day in pairs)
+    last_day = max(day for _, day in pairs)
+    start_dt, end_dt = day_bounds(first_day, last_day)
+
+    async with in_transaction():
+        # Make sure every day has a row and lock them before reading TimeLog.
+        # record_event locks the same rows, so an event it is adding either
+        # lands before this read or is applied on top of the rewritten row.
+        await DailyAttendance.bulk_create(
+            [DailyAttendance(employee_id=employee_id, date=day) for employee_id, day in pairs],
+            ignore_conflicts=True
+        )
+        rows = await DailyAttendance.select_for_update().filter(
+            employee_id__in=employee_ids,
+            date__gte=first_day,
+            date__lte=last_day
+        ).order_by("id")
+        rows = {(row.employee_id, row.date): row for row in rows if (row.employee_id, row.date) in pairs}
+
+        logs = await TimeLog.filter(
+            employee_id__in=employee_ids,
+            timestamp__gte=start_dt,
+            timestamp__lt=end_dt
+        ).order_by("employee_id", "timestamp", "id").values_list("employee_id", "timestamp", "action")
+        states = {pair: DayState() for pair in rows}
+        for employee_id, timestamp, action in logs:
+            state = states.get((employee_id, timestamp.date()))
+            if state:
+                state.apply(timestamp, action)
+
+        # Rows are rewritten in place, never deleted: a record_event waiting
+        # on the lock still finds its row (an empty one reads as absent)
+        if rows:
+            await DailyAttendance.bulk_update(
+                [state.store(rows[pair]) for pair, state in states.items()],
+                fields=["first_entry", "last_exit", "last_in", "in_seconds", "inside", "corrupted"]
+            )
+    return len(states)
+
+
+async def get_attendance_range(employee, start_date: date, end_date: date):
+    # Served from the DailyAttendance rollup: one indexed query of at most
+    # one row per day, regardless of how many raw events the days hold.
+    rows = await rollup_range_query(employee.id, start_date, end_date)
+    days = {row.date: DayState.from_row(row) for row in rows}
+
+    today = date.today()
+    empty = DayState()
+    return [days.get(day, empty).summary(day, today) for day in iter_days(start_date, end_date)]
+
+
+EXPORT_FIELDS = ("empid", "name", "date", "firstEntry", "lastExit", "totalInTime", "totalOutTime", "status")
+
+
+async def stream_timelog(start_date: date, end_date: date, fetch_size: int = 1000):
+    # (employee_id, timestamp, action) for every event in the range, ordered by
+    # employee then time. Read in keyset pages of fetch_size rows, each its own
+    # short query, so a slow or abandoned download holds no pooled connection
+    # between pages and only one page is in memory at a time.
+    start_dt, end_dt = day_bounds(start_date, end_date)
+    after = None
+    while True:
+        query = TimeLog.filter(timestamp__gte=start_dt, timestamp__lt=end_dt)
+        if after:
+            employee_id, timestamp, row_id = after
+            query = query.filter(
+                Q(employee_id__gt=employee_id)
+                | Q(employee_id=employee_id, timestamp__gt=timestamp)
+                | Q(employee_id=employee_id, timestamp=timestamp, id__gt=row_id)
+            )
+        rows = await query.order_by("employee_id", "timestamp", "id").limit(fetch_size).values_list(
+            "employee_id", "timestamp", "action", "id"
+        )
+        for employee_id, timestamp, action, _ in rows:
+            yield employee_id, timestamp, action
+        if len(rows) < fetch_size:
+            break
+        employee_id, timestamp, _, row_id = rows[-1]
+        after = (employee_id, timestamp, row_id)
+
+
+async def _next(events):
+    try:
+        return await events.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def export_attendance(start_date: date, end_date: date):
+    # One summary row per employee-day in the range, absent days included,
+    # paired on the fly from the ordered event stream: only the current
+    # employee-day is kept in memory.
+    employees = await Employee.all().order_by("id").values_list("id", "empid", "name")
+    today = date.today()
+    empty = DayState()
+    events = stream_timelog(start_date, end_date)
+    try:
+        pending = await _next(events)
+        for employee_id, empid, name in employees:
+            # Skip events of employees deleted since the list was read
+            while pending and pending[0] < employee_id:
+                pending = await _next(events)
+            for day in iter_days(start_date, end_date):
+                state = empty
+                if pending and pending[0] == employee_id and pending[1].date() == day:
+                    state = DayState()
+                    while pending and pending[0] == employee_id and pending[1].date() == day:
+                        state.apply(pending[1], pending[2])
+                        pending = await _next(events)
+                yield {"empid": empid, "name": name, **state.summary(day, today)}
+    finally:
+        # Also runs when the client goes away mid-download
+        await events.aclose()
@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+
+
+class BoundedCache:
+    # In-process LRU cache with an optional per-entry TTL and hit/miss counters.
+    # Only touched from the event loop, so it needs no locking.
+    def __init__(self, maxsize: int, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is not None:
+            value, expires = item
+            if expires is None or expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return item[0] if item else default
+
+    def prune(self):
+        # Drop every expired entry, returns how many were dropped
+        now = time.monotonic()
+        keys = [key for key, (_, expires) in self._data.items() if expires is not None and expires <= now]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def discard_where(self, predicate):
+        # Drop every entry whose value matches, returns how many were dropped
+        keys = [key for key, (value, _) in self._data.items() if predicate(value)]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / lookups, 4) if lookups else None
+        }
@@ -0,0 +1,51 @@
+import os
+from datetime import datetime
+import dotenv
+from caches import BoundedCache
+
+dotenv.load_dotenv()
+DEBOUNCE_SECONDS = float(os.getenv("DEBOUNCE_SECONDS", "30"))  # 0 disables
+DEBOUNCE_CACHE_SIZE = int(os.getenv("DEBOUNCE_CACHE_SIZE", "10000"))
+
+
+class EventDebouncer:
+    # A camera sees the same face on many consecutive frames. The first event
+    # per (empid, action, camera) is stored; repeats within window seconds of
+    # the last sighting are acknowledged but dropped, so someone lingering at
+    # the door yields one row. Last-seen times expire with the window, and
+    # like BoundedCache this is only touched from the event loop.
+    def __init__(self, window: float, maxsize: int):
+        self.window = window
+        self.passed = 0
+        self.suppressed = {"IN": 0, "OUT": 0}
+        self._last_seen = BoundedCache(maxsize=maxsize, ttl=window or None)
+
+    def allow(self, empid: str, action: str, camera: str, timestamp: datetime):
+        if not self.window:
+            self.passed += 1
+            return True
+        key = (empid, action, camera)
+        seen = timestamp.timestamp()
+        last = self._last_seen.get(key)
+        self._last_seen.set(key, seen if last is None else max(last, seen))
+        if last is not None and abs(seen - last) < self.window:
+            self.suppressed[action] += 1
+            return False
+        self.passed += 1
+        return True
+
+    def forget(self, empid: str, action: str, camera: str):
+        # The allowed event could not be stored, let the retry through
+        self._last_seen.pop((empid, action, camera))
+
+    def stats(self):
+        return {
+            "windowSeconds": self.window,
+            "passed": self.passed,
+            "suppressed": sum(self.suppressed.values()),
+            "suppressedByAction": dict(self.suppressed),
+            "tracked": len(self._last_seen)
+        }
+
+
+debouncer = EventDebouncer(DEBOUNCE_SECONDS, DEBOUNCE_CACHE_SIZE)
@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import threading
+import dotenv
+from photos import PHOTOS_BASE_PATH, is_image
+
+dotenv.load_dotenv()
+EMBEDDINGS_DIR = os.path.abspath(os.getenv("EMBEDDINGS_DIR") or os.path.join(os.path.dirname(__file__), '..', 'embeddings'))
+MANIFEST_PATH = os.path.join(EMBEDDINGS_DIR, "photo_manifest.json")
+STAGING_DIR = os.path.join(EMBEDDINGS_DIR, "staging")
+OUTPUT_DIR = os.path.join(EMBEDDINGS_DIR, "output")
+
+
+def file_hash(path: str):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PhotoManifest:
+    # Content hashes of every photo as of the last successful embedding build,
+    # plus the empids the routes have marked dirty since. The difference with
+    # what is on disk now is the delta the next build has to embed.
+    #   built: {"<empid>/<file>": {"sha1", "size", "mtime"}}
+    def __init__(self, path: str, photos_root: str):
+        self.path = path
+        self.photos_root = photos_root
+        self.built = {}
+        self.dirty = set()
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+                self.built = data.get("built", {})
+                self.dirty = set(data.get("dirty", []))
+            except FileNotFoundError:
+                pass
+            self._loaded = True
+
+    def save(self):
+        with self._lock:
+            data = {"built": self.built, "dirty": sorted(self.dirty)}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp = self.path + ".tmp"
+            with open(temp, "w") as f:
+                json.dump(data, f)
+            os.replace(temp, self.path)
+
+    async def mark_dirty(self, *empids):
+        await asyncio.to_thread(self.load)
+        with self._lock:
+            self.dirty.update(str(empid) for empid in empids)
+        await asyncio.to_thread(self.save)
+
+    def scan(self):
+        # Current photos with content hashes; files whose size and mtime match
+        # the last build reuse its hash instead of being read again.
+        self.load()
+        current = {}
+        if not os.path.isdir(self.photos_root):
+            return current
+        for emp_entry in os.scandir(self.photos_root):
+            if not emp_entry.is_dir():
+                continue
+            for entry in os.scandir(emp_entry.path):
+                if not entry.is_file() or not is_image(entry.name):
+                    continue
+                key = f"{emp_entry.name}/{entry.name}"
+                stat = entry.stat()
+                known = self.built.get(key)
+                if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+                    sha1 = known["sha1"]
+                else:
+                    sha1 = file_hash(entry.path)
+                current[key] = {"sha1": sha1, "size": stat.st_size, "mtime": stat.st_mtime}
+        return current
+
+    def delta(self, current: dict):
+        def by_empid(entries):
+            grouped = {}
+            for key, info in entries.items():
+                empid, filename = key.split("/", 1)
+                grouped.setdefault(empid, {})[filename] = info["sha1"]
+            return grouped
+
+        before = by_empid(self.built)
+        after = by_empid(current)
+        added = {e: sorted(set(after.get(e, {})) - set(before.get(e, {}))) for e in after}
+        removed = {e: sorted(set(before.get(e, {})) - set(after.get(e, {}))) for e in before}
+        added = {e: files for e, files in added.items() if files}
+        removed = {e: files for e, files in removed.items() if files}
+
+        # A whole folder that vanished while one with the same content appeared is an empid rename
+        gone = [e for e in before if e not in after]
+        new = [e for e in after if e not in before]
+        renamed = []
+        for old in gone:
+            for candidate in new:
+                if sorted(before[old].values()) == sorted(after[candidate].values()):
+                    renamed.append({"from": old, "to": candidate})
+                    new.remove(candidate)
+                    break
+
+        changed = {
+            e for e in after
+            if e not in before or sorted(before[e].values()) != sorted(after[e].values())
+        }
+        changed |= {e for e in self.dirty if e in after}
+        return {
+            "added": added,
+            "removed": removed,
+            "renamed": renamed,
+            "embed": sorted(changed),  # empids whose embeddings must be (re)built
+            "drop": sorted(e for e in before if e not in after)  # empids to remove from the gallery
+        }
+
+    def commit(self, current: dict, dirty_snapshot: set):
+        # Record a successful build; marks that arrived while it ran stay dirty
+        with self._lock:
+            self.built = current
+            self.dirty -= dirty_snapshot
+        self.save()
+
+
+def stage_employees(job_id: str, empids):
+    # Directory holding only the given employees' photo folders, for the
+    # embedding script to process instead of the whole photos tree.
+    staging = os.path.join(STAGING_DIR, job_id)
+    os.makedirs(staging, exist_ok=True)
+    for empid in empids:
+        source = os.path.join(PHOTOS_BASE_PATH, empid)
+        target = os.path.join(staging, empid)
+        try:
+            os.symlink(source, target, target_is_directory=True)
+        except OSError:
+            shutil.copytree(source, target)
+    return staging
+
+
+def output_dir(job_id: str):
+    # Where the embedding script writes embeddings.npy and labels.json
+    path = os.path.join(OUTPUT_DIR, job_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def clear_staging(job_id: str):
+    shutil.rmtree(os.path.join(STAGING_DIR, job_id), ignore_errors=True)
+    shutil.rmtree(os.path.join(OUTPUT_DIR, job_id), ignore_errors=True)
+
+
+photo_manifest = PhotoManifest(MANIFEST_PATH, PHOTOS_BASE_PATH)
@@ -0,0 +1,151 @@
+import json
+import os
+import shutil
+import threading
+import time
+from uuid import uuid4
+import dotenv
+import numpy as np
+from embedding_manifest import EMBEDDINGS_DIR
+
+dotenv.load_dotenv()
+EMBEDDING_STORE_PATH = os.path.abspath(os.getenv("EMBEDDING_STORE_PATH") or os.path.join(EMBEDDINGS_DIR, "store"))
+EMBEDDING_VERSIONS_KEEP = int(os.getenv("EMBEDDING_VERSIONS_KEEP", "3"))
+MATRIX_FILE = "embeddings.npy"
+LABELS_FILE = "labels.json"
+
+
+def normalize(matrix):
+    # Unit-length float32 rows, so cosine similarity is a plain dot product
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim != 2:
+        raise ValueError("Embeddings must be a 2-D array")
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+class EmbeddingVersion:
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        with open(os.path.join(path, LABELS_FILE)) as f:
+            meta = json.load(f)
+        self.labels = meta["labels"]  # empid of each matrix row
+        self.created_at = meta.get("createdAt")
+        # Read-only mapping: every process opening this file shares its pages
+        self.matrix = np.load(os.path.join(path, MATRIX_FILE), mmap_mode="r")
+
+    def info(self):
+        return {
+            "version": self.name,
+            "path": os.path.join(self.path, MATRIX_FILE),
+            "labelsPath": os.path.join(self.path, LABELS_FILE),
+            "count": int(self.matrix.shape[0]),
+            "dim": int(self.matrix.shape[1]) if self.matrix.ndim == 2 else 0,
+            "identities": len(set(self.labels)),
+            "createdAt": self.created_at
+        }
+
+
+class EmbeddingStore:
+    # Immutable versions under <root>/v<N>/ (a float32 .npy matrix and its
+    # empid labels), with <root>/CURRENT naming the live one. Publishing
+    # writes a new version and swaps CURRENT atomically; readers holding an
+    # older version keep using it until they pick up the new name.
+    def __init__(self, root: str, keep: int):
+        self.root = root
+        self.keep = keep
+        self._current = None
+        self._lock = threading.Lock()
+
+    @property
+    def pointer(self):
+        return os.path.join(self.root, "CURRENT")
+
+    def _versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        names = [entry.name for entry in os.scandir(self.root) if entry.is_dir() and entry.name[1:].isdigit() and entry.name[0] == "v"]
+        return sorted(names, key=lambda name: int(name[1:]))
+
+    def current(self):
+        # Live version, reopened when CURRENT has moved on. None if nothing was published.
+        try:
+            with open(self.pointer) as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if self._current is None or self._current.name != name:
+                self._current = EmbeddingVersion(name, os.path.join(self.root, name))
+            return self._current
+
+    def publish(self, matrix, labels):
+        matrix = normalize(matrix)
+        labels = [str(label) for label in labels]
+        if matrix.shape[0] != len(labels):
+            raise ValueError(f"{matrix.shape[0]} embeddings but {len(labels)} labels")
+        # Rows of one empid are stored next to each other so matching can
+        # reduce them per identity with np.maximum.reduceat
+        order = sorted(range(len(labels)), key=labels.__getitem__)
+        matrix = np.ascontiguousarray(matrix[order]) if len(labels) else matrix
+        labels = [labels[i] for i in order]
+        with self._lock:
+            versions = self._versions()
+            name = f"v{int(versions[-1][1:]) + 1 if versions else 1}"
+            os.makedirs(self.root, exist_ok=True)
+            temp = os.path.join(self.root, f".{name}.{uuid4().hex}.tmp")
+            os.makedirs(temp)
+            np.save(os.path.join(temp, MATRIX_FILE), matrix)
+            with open(os.path.join(temp, LABELS_FILE), "w") as f:
+                json.dump({"labels": labels, "createdAt": time.time()}, f)
+            os.rename(temp, os.path.join(self.root, name))
+
+            pointer_temp = f"{self.pointer}.{uuid4().hex}.tmp"
+            with open(pointer_temp, "w") as f:
+                f.write(name)
+            os.replace(pointer_temp, self.pointer)
+
+            # Old versions may still be mapped by workers; on POSIX the pages
+            # stay valid after unlink, elsewhere removal is retried next time.
+            for old in (versions + [name])[:-max(1, self.keep)]:
+                shutil.rmtree(os.path.join(self.root, old), ignore_errors=True)
+        return self.current()
+
+    def merge(self, matrix, labels, drop_empids=()):
+        # New version = current rows minus the given empids and anyone being
+        # re-embedded, plus the new rows. Used after incremental builds.
+        labels = [str(label) for label in labels]
+        replaced = set(labels) | {str(empid) for empid in drop_empids}
+        version = self.current()
+        if version is None:
+            return self.publish(matrix, labels)
+        keep = [i for i, label in enumerate(version.labels) if label not in replaced]
+        matrix = normalize(matrix) if len(labels) else np.empty((0, version.matrix.shape[1]), dtype=np.float32)
+        return self.publish(
+            np.concatenate([version.matrix[keep], matrix]),
+            [version.labels[i] for i in keep] + labels
+        )
+
+    def import_output(self, directory: str, drop_empids=(), full: bool = False):
+        # Pick up what the embedding script wrote into directory (embeddings.npy
+        # and labels.json with {"labels": [...]} or a bare list). None if it wrote nothing.
+        matrix_path = os.path.join(directory, MATRIX_FILE)
+        labels_path = os.path.join(directory, LABELS_FILE)
+        if not os.path.exists(matrix_path) or not os.path.exists(labels_path):
+            # Nothing embedded, but removed employees still leave the gallery
+            if not full and drop_empids and self.current():
+                return self.merge((), [], drop_empids)
+            return None
+        matrix = np.load(matrix_path)
+        with open(labels_path) as f:
+            labels = json.load(f)
+        if isinstance(labels, dict):
+            labels = labels["labels"]
+        if full:
+            return self.publish(matrix, labels)
+        return self.merge(matrix, labels, drop_empids)
+
+
+embedding_store = EmbeddingStore(EMBEDDING_STORE_PATH, EMBEDDING_VERSIONS_KEEP)
@@ -0,0 +1,218 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+import dotenv
+from tortoise.transactions import in_transaction
+from models import TimeLog
+from attendance import record_event, refresh_attendance, as_stored
+
+dotenv.load_dotenv()
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.5"))  # seconds
+WRITE_BEHIND_PUT_TIMEOUT = float(os.getenv("WRITE_BEHIND_PUT_TIMEOUT", "2"))  # seconds
+WRITE_BEHIND_BACKOFF_MAX = float(os.getenv("WRITE_BEHIND_BACKOFF_MAX", "30"))  # seconds between flush retries
+WRITE_BEHIND_SPILL_PATH = os.path.abspath(
+    os.getenv("WRITE_BEHIND_SPILL_PATH") or os.path.join(os.path.dirname(__file__), "write_behind_spill.jsonl")
+)
+STOP_FLUSH_ATTEMPTS = 3  # on shutdown, then the events are spilled
+
+
+class QueueFull(Exception):
+    pass
+
+
+class EventWriter:
+    # Write-behind buffer for TimeLog rows. Events are queued in memory and a
+    # background task commits them in batches once batch_size rows are waiting
+    # or interval seconds have passed since the first one arrived.
+    # A failed flush keeps its batch and is retried with backoff until the
+    # database is back; meanwhile the queue fills and put() pushes back on
+    # clients. Events still unwritten at shutdown are spilled to spill_path
+    # and replayed on the next start.
+    def __init__(self, maxsize: int, batch_size: int, interval: float, put_timeout: float, spill_path: str):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.interval = interval
+        self.put_timeout = put_timeout
+        self.spill_path = spill_path
+        self.queue = None
+        self.task = None
+        self.pending = []  # taken off the queue, not yet handed to a flush
+        self.current = None  # flush in progress
+        self.stopping = False
+        self.stopped = None  # set by stop, cuts a retry backoff short
+        self.flushed = 0
+        self.batches = 0
+        self.rejected = 0
+        self.retries = 0
+        self.spilled = 0
+        self.last_error = None
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self.stopping = False
+        self.stopped = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Flush whatever is still queued, then stop the background task
+        if not self.running:
+            return
+        self.stopping = True  # a flush still retrying gives up and spills
+        self.stopped.set()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        if self.current and not self.current.done():
+            await self.current
+        batch, self.pending = self.pending, []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        if batch:
+            await self._flush(batch)
+        print(f"Event writer stopped, {self.flushed} event(s) written", flush=True)
+
+    async def put(self, log: TimeLog):
+        # Backpressure: wait up to put_timeout for room, then give up
+        try:
+            await asyncio.wait_for(self.queue.put(log), self.put_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise QueueFull()
+
+    async def _run(self):
+        spilled = self._load_spill()
+        if spilled:
+            print(f"Event writer replaying {len(spilled)} spilled event(s)", flush=True)
+            self.current = asyncio.ensure_future(self._replay(spilled))
+            await asyncio.shield(self.current)
+        while True:
+            self.pending.append(await self.queue.get())
+            deadline = time.monotonic() + self.interval
+            while len(self.pending) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    self.pending.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            batch, self.pending = self.pending, []
+            # Shielded so that stopping mid-flush does not lose the batch
+            self.current = asyncio.ensure_future(self._flush(batch))
+            await asyncio.shield(self.current)
+
+    async def _flush(self, batch):
+        batch.sort(key=lambda log: log.timestamp)
+        attempt = 0
+        while True:
+            try:
+                # One transaction, as in write_event: a failed rollup refresh
+                # rolls the rows back and the whole batch is retried
+                async with in_transaction():
+                    await TimeLog.bulk_create(batch, ignore_conflicts=True)
+                    await refresh_attendance({(log.employee_id, as_stored(log.timestamp).date()) for log in batch})
+                break
+            except Exception as e:
+                attempt += 1
+                self.retries += 1
+                self.last_error = str(e)
+                print(f"Event writer flush of {len(batch)} event(s) failed (attempt {attempt}): {e}", flush=True)
+                if self.stopping and attempt >= STOP_FLUSH_ATTEMPTS:
+                    self._spill(batch)
+                    return
+                try:
+                    await asyncio.wait_for(self.stopped.wait(), min(2 ** (attempt - 1), WRITE_BEHIND_BACKOFF_MAX))
+                except asyncio.TimeoutError:
+                    pass
+        self.flushed += len(batch)
+        self.batches += 1
+        self.last_error = None
+
+    def _spill(self, batch):
+        # Append the events as JSON lines; the next start() replays them
+        with open(self.spill_path, "a") as f:
+            for log in batch:
+                f.write(json.dumps({
+                    "employee_id": log.employee_id,
+                    "action": log.action,
+                    "timestamp": log.timestamp.isoformat(),
+                    "camera": log.camera,
+                    "event_id": log.event_id
+                }) + "\n")
+        self.spilled += len(batch)
+        print(f"Event writer spilled {len(batch)} event(s) to {self.spill_path}", flush=True)
+
+    async def _replay(self, batch):
+        await self._flush(batch)
+        os.remove(self.replay_path)
+
+    @property
+    def replay_path(self):
+        return self.spill_path + ".replay"
+
+    def _load_spill(self):
+        # Moved aside while it is replayed and removed once the replay is
+        # written or spilled again, so a crash mid-replay loses nothing
+        if os.path.exists(self.spill_path):
+            with open(self.spill_path) as src, open(self.replay_path, "a") as dst:
+                dst.write(src.read())
+            os.remove(self.spill_path)
+        try:
+            with open(self.replay_path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        batch = []
+        for line in lines:
+            event = json.loads(line)
+            event["timestamp"] = datetime.fromisoformat(event["timestamp"])
+            batch.append(TimeLog(**event))
+        return batch
+
+    def stats(self):
+        return {
+            "enabled": self.running,
+            "queued": self.queue.qsize() if self.queue else 0,
+            "maxsize": self.maxsize,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "spilled": self.spilled,
+            "lastError": self.last_error
+        }
+
+
+event_writer = EventWriter(
+    WRITE_BEHIND_QUEUE_SIZE,
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_INTERVAL,
+    WRITE_BEHIND_PUT_TIMEOUT,
+    WRITE_BEHIND_SPILL_PATH
+)
+
+
+async def write_event(employee_id: int, action: str, timestamp, camera: str = None):
+    # Store one TimeLog row, through the write-behind buffer when it is enabled
+    if event_writer.running:
+        await event_writer.put(TimeLog(employee_id=employee_id, action=action, timestamp=timestamp, camera=camera))
+        return
+    # One transaction: if the rollup update fails the row is not kept either,
+    # so the client's retry cannot store the event twice
+    async with in_transaction():
+        await TimeLog.create(employee_id=employee_id, action=action, timestamp=timestamp, camera=camera)
+        await record_event(employee_id, timestamp, action)
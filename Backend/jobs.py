@@ -0,0 +1,201 @@
+import asyncio
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
+import dotenv
+from embedding_manifest import clear_staging, output_dir, photo_manifest, stage_employees
+from embedding_store import embedding_store, EMBEDDING_STORE_PATH
+from supervisor import LogBuffer
+
+dotenv.load_dotenv()
+ENV_PATH = os.getenv("ENV_PATH")
+EMBD_PATH = os.getenv("EMBD_PATH")
+PHOTOS_PATH = os.getenv("PHOTOS_PATH")
+JOB_LOG_LINES = int(os.getenv("JOB_LOG_LINES", "2000"))
+JOB_HISTORY = 20
+
+# Embedding script contract. The script is run as
+#   ENV_PATH EMBD_PATH <photos folder>
+# where the folder holds one sub-folder of photos per empid, with:
+#   EMBEDDING_MODE            "full": the folder is all of PHOTOS_PATH, build
+#                             the whole gallery. "incremental": the folder is
+#                             a staging copy holding only the employees that
+#                             changed; embed just those.
+#   EMBEDDING_REMOVED_EMPIDS  comma separated empids deleted since the last build
+#   EMBEDDING_OUTPUT          folder to write the result into:
+#                               embeddings.npy  float32 (rows, dim) matrix
+#                               labels.json     JSON list, the empid of each row
+#   EMBEDDING_STORE           root of the versioned embedding store
+# Progress is read from "n/m" or "n of m" in its output, exit code 0 means success.
+# A full job publishes the output (if any) as a new store version; an
+# incremental job merges it into the current version and fails when the
+# script wrote none, since a script unaware of the contract would otherwise
+# have rebuilt its own gallery from the staged employees alone.
+
+# "12/40" or "12 of 40" anywhere in a line of the embedding script's output
+PROGRESS_PATTERN = re.compile(r"(\d+)\s*(?:/|of)\s*(\d+)")
+
+
+class JobConflict(Exception):
+    def __init__(self, job):
+        self.job = job
+
+
+class EmbeddingJob:
+    def __init__(self, username: str, full: bool = True):
+        self.id = uuid4().hex
+        self.username = username
+        self.mode = "full" if full else "incremental"
+        self.delta = None
+        self.version = None  # embedding store version published by this job
+        self.state = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.returncode = None
+        self.error = None
+        self.current = None
+        self.total = None
+        self.logs = LogBuffer(JOB_LOG_LINES)
+        self.task = None
+
+    @property
+    def active(self):
+        return self.state in ("queued", "running")
+
+    def progress(self):
+        if self.state == "succeeded":
+            return {"current": self.total, "total": self.total, "percent": 100}
+        if not self.total:
+            return {"current": self.current, "total": self.total, "percent": None}
+        return {"current": self.current, "total": self.total, "percent": round(100 * self.current / self.total, 1)}
+
+    def status(self, lines: int = 50):
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "progress": self.progress(),
+            "mode": self.mode,
+            "delta": self.delta,
+            "version": self.version,
+            "startedBy": self.username,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+            "returncode": self.returncode,
+            "error": self.error,
+            "logs": self.logs.tail(lines)
+        }
+
+
+class EmbeddingJobManager:
+    # Runs the embedding script as a background job, one at a time, and keeps
+    # the last JOB_HISTORY jobs around for status queries.
+    def __init__(self):
+        self.jobs = OrderedDict()
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def active(self):
+        return next((job for job in self.jobs.values() if job.active), None)
+
+    def submit(self, username: str, full: bool = True):
+        running = self.active()
+        if running:
+            raise JobConflict(running)
+        job = EmbeddingJob(username, full)
+        self.jobs[job.id] = job
+        while len(self.jobs) > JOB_HISTORY:
+            self.jobs.popitem(last=False)
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    def command(self, photos_path: str = None):
+        return [os.path.abspath(ENV_PATH), os.path.abspath(EMBD_PATH), os.path.abspath(photos_path or PHOTOS_PATH)]
+
+    async def _run(self, job: EmbeddingJob):
+        job.state = "running"
+        job.started_at = time.time()
+        try:
+            # Compare the photos on disk with the manifest of the last successful
+            # build. An incremental job hands the script only the employees that
+            # changed (through a staging folder) and the empids to drop.
+            current = await asyncio.to_thread(photo_manifest.scan)
+            dirty = set(photo_manifest.dirty)
+            job.delta = photo_manifest.delta(current)
+            photos_path = None
+            if job.mode == "incremental" and await asyncio.to_thread(embedding_store.current) is None:
+                job.mode = "full"  # nothing to merge into yet
+                job.logs.append("No published embeddings yet, running a full build")
+            if job.mode == "incremental":
+                if not job.delta["embed"] and not job.delta["drop"]:
+                    job.logs.append("Embeddings are up to date")
+                    await asyncio.to_thread(photo_manifest.commit, current, dirty)
+                    job.state = "succeeded"
+                    return
+                photos_path = await asyncio.to_thread(stage_employees, job.id, job.delta["embed"])
+                job.logs.append(f"Embedding {len(job.delta['embed'])} employee(s), dropping {len(job.delta['drop'])}")
+            output = await asyncio.to_thread(output_dir, job.id)
+
+            process = await asyncio.to_thread(
+                subprocess.Popen,
+                self.command(photos_path),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                env={
+                    **os.environ,
+                    "EMBEDDING_MODE": job.mode,
+                    "EMBEDDING_REMOVED_EMPIDS": ",".join(job.delta["drop"]),
+                    "EMBEDDING_OUTPUT": output,
+                    "EMBEDDING_STORE": EMBEDDING_STORE_PATH
+                }
+            )
+            reader = threading.Thread(target=self._drain, args=(job, process), name=f"job {job.id}", daemon=True)
+            reader.start()
+            job.returncode = await asyncio.to_thread(process.wait)
+            await asyncio.to_thread(reader.join)
+            if job.returncode == 0:
+                version = await asyncio.to_thread(
+                    embedding_store.import_output, output, job.delta["drop"], job.mode == "full"
+                )
+                if version:
+                    job.version = version.name
+                    job.logs.append(f"Published embeddings {version.name} ({version.matrix.shape[0]} rows)")
+                if version is None and job.mode == "incremental":
+                    # The manifest is not advanced, the next job retries the same delta
+                    job.state = "failed"
+                    job.error = "The embedding script wrote no output to EMBEDDING_OUTPUT; run a full build"
+                else:
+                    await asyncio.to_thread(photo_manifest.commit, current, dirty)
+                    job.state = "succeeded"
+            else:
+                job.state = "failed"
+                job.error = f"Embedding generation failed with exit code {job.returncode}"
+        except Exception as e:
+            job.state = "failed"
+            job.error = f"An unexpected error occurred: {str(e)}"
+        finally:
+            await asyncio.to_thread(clear_staging, job.id)
+            job.finished_at = time.time()
+            job.logs.close()
+            print(f"Embedding job {job.id} {job.state}", flush=True)
+
+    def _drain(self, job: EmbeddingJob, process):
+        for line in iter(process.stdout.readline, ""):
+            line = line.strip()
+            if not line:
+                continue
+            match = PROGRESS_PATTERN.search(line)
+            if match and int(match.group(2)) > 0:
+                job.current, job.total = int(match.group(1)), int(match.group(2))
+            job.logs.append(line)
+        process.stdout.close()
+
+
+embedding_jobs = EmbeddingJobManager()
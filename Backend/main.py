@@ -3,24 +3,33 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from tortoise.contrib.fastapi import register_tortoise
-from models import Admin, TimeLog, Employee,Environment
+from models import Admin, TimeLog, Employee,Environment,Camera
 from pydantic import BaseModel
 from pydantic_models import AdminIn, EmployeeIn,ConfigIn
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 import dotenv
 import os
-from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
 from routes.employee_routes import router as employee_router
-from utils import authenticate_user, generate_frames,authenticate_employee,convert_to_local,format_duration
+from utils import authenticate_user,authenticate_employee,convert_to_local,format_duration
+from utils import resolve_identity,invalidate_admin
 from fastapi.middleware.cors import CORSMiddleware
-from utils import is_valid_rtsp_url,is_rtsp_stream_accessible,verify_password,create_token
+from utils import is_valid_rtsp_url,verify_password,hash_password,create_token
 import urllib.parse
 from fastapi.responses import StreamingResponse
 import time
 from tortoise import Tortoise
-from routes.model_routes import router as model_router
+from routes.model_routes import router as model_router, save_config_cameras, config_camera_urls
+from attendance import get_attendance_range
+from schema import ensure_schema
+from pagination import parse_fields, prefix_search, fetch_page, MAX_PAGE_SIZE
+from ingest import event_writer, WRITE_BEHIND
+from photos import photo_index, UploadLimitMiddleware
+from supervisor import supervisor
+from streaming import frame_hubs, snapshots, camera_prober, StreamProfile, DEFAULT_PROFILE, SNAPSHOT_TTL
+import asyncio
+from typing import Optional
 from datetime import date
 dotenv.load_dotenv()
 CORS_ORIGIN = os.getenv("CORS_ORIGIN")
@@ -29,7 +38,6 @@ ALGORITHM = os.getenv("ALGORITHM")
 EXPIRE_TIME = os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 app  = FastAPI()
@@ -38,30 +46,69 @@ photos_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'pho
 print(f"Photos directory: {photos_path}")
 app.mount("/static/photos", StaticFiles(directory=photos_path), name="photos")
 
+# Registered before register_tortoise so that on shutdown the write-behind
+# buffer is flushed while the database connections are still open.
+@app.on_event("startup")
+async def start_event_writer():
+    if WRITE_BEHIND:
+        await event_writer.start()
+
+@app.on_event("shutdown")
+async def stop_event_writer():
+    await event_writer.stop()
+
+@app.on_event("shutdown")
+async def stop_camera_workers():
+    await supervisor.stop()
+
 register_tortoise(
     app,
     config_file="tortoise_config.json",
     generate_schemas=True,  # Auto-create tables
     add_exception_handlers=True,
 )
+# Added before CORS so that CORS wraps it and its 413 replies carry the CORS headers
+app.add_middleware(UploadLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=CORS_ORIGIN,  # list of allowed origins
     allow_credentials=True,
     allow_methods=["*"],  # allow all HTTP methods: POST, GET, OPTIONS etc.
     allow_headers=["*"],  # allow all headers
+    expose_headers=["X-Next-Cursor"],
 )
 app.include_router(employee_router)
 app.include_router(model_router)
 
+@app.on_event("startup")
+async def update_schema():
+    # Runs after register_tortoise's startup hook has created the tables
+    await ensure_schema()
+
+@app.on_event("startup")
+async def build_photo_index():
+    summary = await asyncio.to_thread(photo_index.rescan)
+    print(f"Photo index: {summary['photos']} photo(s) for {summary['employees']} employee(s)")
+
 
 @app.get("/admin")
-async def get_admins(username = Depends(authenticate_user)):
+async def get_admins(
+    cursor: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    q: Optional[str] = Query(None, min_length=1, max_length=100),
+    username = Depends(authenticate_user)
+):
     if username != "superuser":
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    admins = await Admin.all().values("id", "username")
-    return JSONResponse(content=admins)
+    # The body stays a plain list; the next page's cursor is sent in X-Next-Cursor
+    query = Admin.all()
+    if q:
+        query = query.filter(prefix_search(q, ("username",)))
+    admins, next_cursor = await fetch_page(query, parse_fields(fields, ("id", "username")), cursor, limit)
+    headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else None
+    return JSONResponse(content=admins, headers=headers)
 
 @app.post("/admin")
 async def create_admins(admin: AdminIn,username = Depends(authenticate_user)):
@@ -72,7 +119,7 @@ async def create_admins(admin: AdminIn,username = Depends(authenticate_user)):
     existing_admin = await Admin.get_or_none(username=admin.username)
     if existing_admin:
         raise HTTPException(status_code=400, detail="Admin with this username already exists")
-    admin.password = pwd_context.hash(admin.password)
+    admin.password = await hash_password(admin.password)
     admin_obj = await Admin.create(**admin.model_dump())
     return {admin_obj}    
 
@@ -88,12 +135,13 @@ async def delete_admin(admin_id: int,username = Depends(authenticate_user)):
     if not admin:
         raise HTTPException(status_code=404, detail="Admin not found")
     await admin.delete()
+    invalidate_admin(admin.username)
     return {"message": "Admin deleted successfully"}
 
 @app.post("/login")
 async def login(response:Response,username:str = Form(...),password:str = Form(...)):
     admin = await Admin.get_or_none(username=username)
-    if not admin or not verify_password(password, admin.password):
+    if not admin or not await verify_password(password, admin.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_token({"sub": admin.username})
     response.set_cookie(
@@ -127,15 +175,15 @@ async def change_password(
         raise HTTPException(status_code=404, detail="Admin not found")
 
     # Verify old password
-    if not pwd_context.verify(old_password, admin.password):
+    if not await verify_password(old_password, admin.password):
         raise HTTPException(status_code=401, detail="Incorrect old password")
 
-    # Prevent using the same password again
-    if pwd_context.verify(new_password, admin.password):
+    # Prevent using the same password again (old_password is known to match)
+    if new_password == old_password:
         raise HTTPException(status_code=400, detail="New password must be different from the old password")
 
     # Hash and update the password
-    admin.password = pwd_context.hash(new_password)
+    admin.password = await hash_password(new_password)
     await admin.save()
 
     return {"message": "Password changed successfully"}
@@ -145,29 +193,37 @@ async def change_password(
 @app.get("/getme")
 async def authenticate_any_user(request: Request):
     try:
-        username = await authenticate_user(request)
-        return {"type": "admin", "username": username}
+        return await resolve_identity(request)
     except HTTPException:
-        pass  # Try the next one
-
-    try:
-        empid = await authenticate_employee(request)
-        return {"type": "employee", "empid": empid}
-    except HTTPException:
-        pass
-
-    raise HTTPException(status_code=401, detail="Authentication failed")
+        raise HTTPException(status_code=401, detail="Authentication failed")
 
 
 @app.get("/configure")
 async def get_config(username = Depends(authenticate_user)):
     if username != "superuser":
         raise HTTPException(status_code=403, detail="Forbidden")
-    envs_enter = await Environment.get_or_none(key="CAMERA_ENTER")
-    envs_exit = await Environment.get_or_none(key="CAMERA_EXIT")
-    if not envs_enter or not envs_exit:
+    camera_enter, camera_exit = await config_camera_urls()
+    if not camera_enter or not camera_exit:
         raise HTTPException(status_code=404, detail="Configuration not found")
-    return {"camera_enter": envs_enter.value, "camera_exit": envs_exit.value}
+    return {"camera_enter": camera_enter, "camera_exit": camera_exit}
+
+
+@app.get("/configure/probe")
+async def probe_config(refresh: bool = False, username = Depends(authenticate_user)):
+    if username != "superuser":
+        raise HTTPException(status_code=403, detail="Forbidden")
+    # The configured enter/exit cameras are registry rows like any other
+    cameras = await Camera.all().order_by("site", "camera_id").values_list("camera_id", "url")
+    if not cameras:
+        cameras = [
+            (key.lower(), url)
+            for key, url in await Environment.filter(key__in=["CAMERA_ENTER", "CAMERA_EXIT"]).values_list("key", "value")
+        ]
+    results = await camera_prober.probe_many([url for _, url in cameras], refresh)
+    return {"cameras": [
+        {"name": name, "url": url, **result}
+        for (name, url), result in zip(cameras, results)
+    ]}
 
 
 @app.post("/configure")
@@ -177,26 +233,23 @@ async def set_config(cfg:ConfigIn, username = Depends(authenticate_user)):
     if(not cfg.camera_enter or not cfg.camera_exit or not is_valid_rtsp_url(cfg.camera_enter) or not is_valid_rtsp_url(cfg.camera_exit)):
         raise HTTPException(status_code=400, detail="Invalid configuration values")
     
-    if(is_rtsp_stream_accessible(cfg.camera_enter) == False):
-        raise HTTPException(status_code=400, detail="Camera enter stream is not accessible")
-    if(is_rtsp_stream_accessible(cfg.camera_exit) == False):
-        raise HTTPException(status_code=400, detail="Camera exit stream is not accessible")
-    envs = await Environment.get_or_none(key="CAMERA_ENTER")
-    if envs:
-        envs.value = cfg.camera_enter
-        await envs.save()
-    else:
-        await Environment.create(key="CAMERA_ENTER", value=cfg.camera_enter)
-    envs = await Environment.get_or_none(key="CAMERA_EXIT")
-    if envs:
-        envs.value = cfg.camera_exit
-        await envs.save()
-    else:
-        await Environment.create(key="CAMERA_EXIT", value=cfg.camera_exit)
+    # Probe both cameras concurrently, each with a hard timeout. Always fresh:
+    # a cached result would reject a camera just fixed or accept one just gone.
+    enter_probe, exit_probe = await camera_prober.probe_many([cfg.camera_enter, cfg.camera_exit], refresh=True)
+    if not enter_probe["reachable"]:
+        raise HTTPException(status_code=400, detail=f"Camera enter stream is not accessible: {enter_probe['error']}")
+    if not exit_probe["reachable"]:
+        raise HTTPException(status_code=400, detail=f"Camera exit stream is not accessible: {exit_probe['error']}")
+    await save_config_cameras(cfg.camera_enter, cfg.camera_exit)
     return {"message": "Configuration updated successfully"}
 
 @app.get("/stream")
-async def stream_camera(request: Request):
+async def stream_camera(
+    request: Request,
+    max_width: int = Query(None, ge=0, le=7680),  # 0 = native resolution
+    fps: float = Query(None, ge=0, le=60),  # 0 = every frame
+    quality: int = Query(None, ge=10, le=100)
+):
     rtsp_url = request.query_params.get("url")
     print(f"Received RTSP URL: {rtsp_url}")
     if not rtsp_url:
@@ -211,12 +264,41 @@ async def stream_camera(request: Request):
     # Use try-except to catch any OpenCV errors
     try:
         return StreamingResponse(
-            generate_frames(decoded_url),
+            frame_hubs.subscribe(decoded_url, StreamProfile(
+                DEFAULT_PROFILE.max_width if max_width is None else max_width,
+                DEFAULT_PROFILE.fps if fps is None else fps,
+                DEFAULT_PROFILE.quality if quality is None else quality
+            )),
             media_type="multipart/x-mixed-replace; boundary=frame"
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
+
+@app.get("/stream/snapshot")
+async def stream_snapshot(
+    url: str = Query(...),
+    max_width: int = Query(None, ge=0, le=7680),  # 0 = native resolution
+    quality: int = Query(None, ge=10, le=100)
+):
+    decoded_url = urllib.parse.unquote(url)
+    if not decoded_url.startswith("rtsp://"):
+        raise HTTPException(status_code=400, detail="Invalid RTSP URL")
+
+    try:
+        jpeg = await snapshots.get(
+            decoded_url,
+            DEFAULT_PROFILE.max_width if max_width is None else max_width,
+            DEFAULT_PROFILE.quality if quality is None else quality
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Camera did not answer in time")
+    if jpeg is None:
+        raise HTTPException(status_code=502, detail="Cannot read a frame from the camera")
+    return Response(content=jpeg, media_type="image/jpeg", headers={"Cache-Control": f"max-age={int(SNAPSHOT_TTL)}"})
+
+@app.get("/stream/hubs")
+async def get_stream_hubs(username = Depends(authenticate_user)):
+    return {"hubs": frame_hubs.stats(), "snapshots": snapshots.stats()}
 
 @app.get("/user-attendance")
 async def get_user_attendance_summary(
@@ -229,72 +311,4 @@ async def get_user_attendance_summary(
     if not employee:
         return {"error": "Employee not found"}
 
-    result = []
-    today = date.today()
-
-    current = start_date
-    while current <= end_date:
-        next_day = current + timedelta(days=1)
-        logs = await TimeLog.filter(
-            employee=employee,
-            timestamp__gte=datetime.combine(current, datetime.min.time()),
-            timestamp__lt=datetime.combine(next_day, datetime.min.time())
-        ).order_by("timestamp")
-
-        entry_time = None
-        exit_time = None
-        in_time = 0
-        corrupted = False
-        inside = False
-        last_in = None
-        in_out_pairs = []
-
-        for log in logs:
-            if log.action == "IN":
-                if inside:
-                    corrupted = True  # Two consecutive INs
-                else:
-                    last_in = log.timestamp
-                    inside = True
-                    if not entry_time:
-                        entry_time = log.timestamp
-            elif log.action == "OUT":
-                if inside and last_in:
-                    delta = (log.timestamp - last_in).total_seconds()
-                    in_time += delta
-                    in_out_pairs.append((last_in, log.timestamp))
-                    exit_time = log.timestamp
-                    inside = False
-                    last_in = None
-                else:
-                    corrupted = True  # OUT without prior IN
-
-        # Handle unmatched IN (still inside)
-        if inside:
-            if current == today:
-                corrupted = False  # Allow it for today
-                exit_time = None  # Don't set lastExit if still inside
-            else:
-                corrupted = True
-
-        total_span = 0
-        total_out_time = 0
-        if entry_time and exit_time and entry_time < exit_time:
-            total_span = (exit_time - entry_time).total_seconds()
-            total_out_time = total_span - in_time
-         # Python 3.9+
-# Or use `pytz` if you're on Python < 3.9
-
-        
-        result.append({
-            "date": current.strftime("%Y-%m-%d"),
-            "firstEntry": convert_to_local(entry_time).strftime("%I:%M %p") if entry_time else "-",
-            "lastExit": convert_to_local(exit_time).strftime("%I:%M %p") if exit_time else "-",  # will be "-" if still inside today
-            "totalInTime": format_duration(int(in_time)) if entry_time and exit_time else "-",
-            "totalOutTime": format_duration(int(total_out_time)) if entry_time and exit_time else "-",
-            "status": "Present" if entry_time and not corrupted else ("Absent" if not entry_time else "Corrupted")
-        })
-
-        current += timedelta(days=1)
-
-    return result
\ No newline at end of file
+    return await get_attendance_range(employee, start_date, end_date)
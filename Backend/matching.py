@@ -0,0 +1,89 @@
+import os
+import threading
+import dotenv
+import numpy as np
+from embedding_store import embedding_store, normalize
+
+dotenv.load_dotenv()
+MATCH_THRESHOLD = float(os.getenv("MATCH_THRESHOLD", "0.5"))  # minimum cosine score
+MATCH_TOP_K = int(os.getenv("MATCH_TOP_K", "5"))
+MAX_MATCH_QUERIES = int(os.getenv("MAX_MATCH_QUERIES", "256"))
+
+
+class GalleryIndex:
+    # Cosine top-k over a gallery of unit-length rows grouped by empid (as the
+    # embedding store writes them). A batch of queries is scored with a single
+    # matrix multiply, reduced to the best row per identity, and the top k
+    # identities are picked with argpartition instead of a full sort.
+    def __init__(self, matrix, labels):
+        self.matrix = matrix
+        labels = np.asarray(labels)
+        if len(labels) and np.any(labels[1:] < labels[:-1]):
+            order = np.argsort(labels, kind="stable")
+            self.matrix, labels = np.ascontiguousarray(matrix[order]), labels[order]
+        self.starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]]) if len(labels) else np.empty(0, dtype=np.intp)
+        self.empids = labels[self.starts].tolist()
+        self.grouped = len(self.starts) != len(labels)  # some empid has several rows
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    def scores(self, queries):
+        # (queries, identities) best cosine score per identity
+        scores = queries @ self.matrix.T
+        if self.grouped:
+            scores = np.maximum.reduceat(scores, self.starts, axis=1)
+        return scores
+
+    def search(self, queries, top_k: int, threshold: float):
+        queries = normalize(queries)
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"Embeddings have dimension {queries.shape[1]}, the gallery has {self.dim}")
+        if not self.empids:
+            return [[] for _ in range(len(queries))]
+        scores = self.scores(queries)
+        k = min(top_k, scores.shape[1])
+        if k < scores.shape[1]:
+            top = np.argpartition(scores, -k, axis=1)[:, -k:]
+        else:
+            top = np.broadcast_to(np.arange(k), (len(scores), k))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+        return [
+            [
+                {"empid": self.empids[i], "score": round(float(score), 4)}
+                for i, score in zip(row, row_scores) if score >= threshold
+            ]
+            for row, row_scores in zip(top, top_scores)
+        ]
+
+
+class Matcher:
+    # GalleryIndex of the embedding store's current version, rebuilt when it changes
+    def __init__(self, store):
+        self.store = store
+        self._index = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def index(self):
+        version = self.store.current()
+        if version is None:
+            return None, None
+        with self._lock:
+            if self._version is not version:
+                self._index = GalleryIndex(version.matrix, version.labels)
+                self._version = version
+            return self._version, self._index
+
+    def match(self, queries, top_k: int = MATCH_TOP_K, threshold: float = MATCH_THRESHOLD):
+        # Blocking (BLAS releases the GIL), run it in a worker thread
+        version, index = self.index()
+        if index is None:
+            return None, None
+        return version.name, index.search(queries, top_k, threshold)
+
+
+matcher = Matcher(embedding_store)
@@ -10,7 +10,7 @@ class Employee(Model):
     id = fields.IntField(pk=True)
     empid = fields.CharField(max_length=50,unique=True)
     password = fields.CharField(max_length=100)
-    name = fields.CharField(max_length=50)
+    name = fields.CharField(max_length=50, index=True)  # prefix search in listings
     email = fields.CharField(max_length=100,unique=True)
     logs: fields.ReverseRelation["TimeLog"]
 
@@ -19,8 +19,40 @@ class TimeLog(Model):
     employee = fields.ForeignKeyField("models.Employee", related_name="logs")
     timestamp = fields.DatetimeField(auto_now_add=False)
     action = fields.CharField(max_length=10, choices=["IN", "OUT"]) 
+    camera = fields.CharField(max_length=50, null=True)
+    event_id = fields.CharField(max_length=64, null=True, unique=True)  # client-supplied, makes retries idempotent
+
+    class Meta:
+        # (employee, timestamp) serves per-employee range reads,
+        # (timestamp, action) the org-wide daily summary.
+        indexes = (("employee", "timestamp"), ("timestamp", "action"))
+
+class Camera(Model):
+    # One recognition worker is supervised per enabled camera
+    id = fields.IntField(pk=True)
+    camera_id = fields.CharField(max_length=50, unique=True)
+    url = fields.CharField(max_length=255)
+    direction = fields.CharField(max_length=10, choices=["enter", "exit"])
+    site = fields.CharField(max_length=50, default="default", index=True)
+    enabled = fields.BooleanField(default=True)
 
 class Environment(Model):
     id = fields.IntField(pk=True)
     key = fields.CharField(max_length=50, unique=True)
-    value = fields.CharField(max_length=100)
\ No newline at end of file
+    value = fields.CharField(max_length=100)
+
+class DailyAttendance(Model):
+    # Rollup of TimeLog, one row per employee per day. Holds the IN/OUT
+    # pairing state so it can be advanced one event at a time.
+    id = fields.IntField(pk=True)
+    employee = fields.ForeignKeyField("models.Employee", related_name="daily_attendance")
+    date = fields.DateField()
+    first_entry = fields.DatetimeField(null=True)
+    last_exit = fields.DatetimeField(null=True)
+    last_in = fields.DatetimeField(null=True)
+    in_seconds = fields.FloatField(default=0)
+    inside = fields.BooleanField(default=False)
+    corrupted = fields.BooleanField(default=False)
+
+    class Meta:
+        unique_together = (("employee", "date"),)
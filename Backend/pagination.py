@@ -0,0 +1,54 @@
+import os
+from typing import Optional
+import dotenv
+from fastapi import HTTPException
+from tortoise.expressions import Q
+
+dotenv.load_dotenv()
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+
+# Upper bound for prefix ranges: sorts after every real character in the
+# MySQL collations, so "name >= q AND name < q + PREFIX_END" matches the
+# same rows as "name LIKE 'q%'" (case-insensitively under *_ci).
+PREFIX_END = "\uffff"
+
+
+def parse_fields(fields: Optional[str], allowed):
+    # fields=name,email -> ("name", "email"); all allowed fields when not given
+    if not fields:
+        return tuple(allowed)
+    wanted = tuple(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = [field for field in wanted if field not in allowed]
+    if unknown or not wanted:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    return wanted
+
+
+def prefix_search(q: str, columns):
+    # Prefix match on any of the columns, written as index ranges: Tortoise's
+    # startswith wraps the column in CAST() on MySQL, which no index can serve
+    return Q(
+        *(Q(**{f"{column}__gte": q, f"{column}__lt": q + PREFIX_END}) for column in columns),
+        join_type="OR"
+    )
+
+
+async def fetch_page(query, fields, cursor: Optional[int] = None, limit: Optional[int] = None):
+    # Keyset page ordered by id: rows with id > cursor, at most limit of them.
+    # Returns (rows, next_cursor); next_cursor is None on the last page.
+    # Without a limit every remaining row is returned, as before paging.
+    query = query.order_by("id")
+    if cursor is not None:
+        query = query.filter(id__gt=cursor)
+    columns = fields if "id" in fields else ("id", *fields)
+    if limit is None:
+        rows = await query.values(*columns)
+        next_cursor = None
+    else:
+        rows = await query.limit(limit + 1).values(*columns)
+        next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+        rows = rows[:limit]
+    if "id" not in fields:
+        for row in rows:
+            del row["id"]
+    return rows, next_cursor
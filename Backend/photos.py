@@ -0,0 +1,190 @@
+import asyncio
+import json
+import os
+import threading
+import dotenv
+from uuid import uuid4
+
+dotenv.load_dotenv()
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+PHOTOS_BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'photos'))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))  # per photo
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_BYTES", str(100 * 1024 * 1024)))  # whole multipart body
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def is_image(filename: str):
+    return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def format_size(size: int):
+    for unit, scale in (("MB", 1024 * 1024), ("KB", 1024)):
+        if size >= scale:
+            return f"{size / scale:g} {unit}" if size % scale == 0 else f"{size / scale:.1f} {unit}"
+    return f"{size} bytes"
+
+
+class PhotoIndex:
+    # In-memory manifest of photos/<empid>/<file>. Built by one directory scan
+    # and kept current by the employee routes, so listings never touch disk.
+    def __init__(self, root: str):
+        self.root = root
+        self._photos = None
+        self._lock = threading.RLock()  # rescan may run in a worker thread
+
+    def rescan(self):
+        photos = {}
+        if os.path.isdir(self.root):
+            for entry in os.scandir(self.root):
+                if not entry.is_dir():
+                    continue
+                files = sorted(f.name for f in os.scandir(entry.path) if f.is_file() and is_image(f.name))
+                if files:
+                    photos[entry.name] = files
+        with self._lock:
+            self._photos = photos
+        return {"employees": len(photos), "photos": sum(len(files) for files in photos.values())}
+
+    def _index(self):
+        if self._photos is None:
+            self.rescan()
+        return self._photos
+
+    def list(self, empid: str):
+        return list(self._index().get(str(empid), ()))
+
+    def first(self, empid: str):
+        files = self._index().get(str(empid))
+        return files[0] if files else None
+
+    def count(self, empid: str):
+        return len(self._index().get(str(empid), ()))
+
+    def contains(self, empid: str, filename: str):
+        return filename in self._index().get(str(empid), ())
+
+    def add(self, empid: str, filename: str):
+        if not is_image(filename):
+            return
+        with self._lock:
+            files = self._index().setdefault(str(empid), [])
+            if filename not in files:
+                files.append(filename)
+
+    def remove(self, empid: str, filename: str):
+        with self._lock:
+            files = self._index().get(str(empid))
+            if files and filename in files:
+                files.remove(filename)
+                if not files:
+                    del self._photos[str(empid)]
+
+    def drop(self, empid: str):
+        with self._lock:
+            self._index().pop(str(empid), None)
+
+    def rename(self, old_empid: str, new_empid: str):
+        with self._lock:
+            files = self._index().pop(str(old_empid), None)
+            if files:
+                self._photos[str(new_empid)] = files
+
+
+photo_index = PhotoIndex(PHOTOS_BASE_PATH)
+
+
+async def save_upload(file, directory: str, max_bytes: int = MAX_UPLOAD_BYTES):
+    # Stream an UploadFile to <directory>/<random name><ext> in chunks, with
+    # the blocking file I/O in worker threads. Aborts (and removes the partial
+    # file) with UploadTooLarge as soon as max_bytes is exceeded.
+    ext = os.path.splitext(file.filename or "")[1]
+    filename = f"{uuid4().hex}{ext}"
+    path = os.path.join(directory, filename)
+
+    await asyncio.to_thread(os.makedirs, directory, exist_ok=True)
+    out = await asyncio.to_thread(open, path, "wb")
+    written = 0
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > max_bytes:
+                raise UploadTooLarge(file.filename)
+            await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        await asyncio.to_thread(out.close)
+        await asyncio.to_thread(os.remove, path)
+        raise
+    await asyncio.to_thread(out.close)
+    return filename
+
+
+class UploadLimitMiddleware:
+    # Starlette reads and spools the whole multipart body before a route runs,
+    # so save_upload's per-file limit cannot bound what the server accepts.
+    # This caps multipart request bodies while they are received: a declared
+    # Content-Length over max_bytes is refused before reading, and a body that
+    # grows past it is cut off and answered with 413 instead of the app's reply.
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get("headers") or []) if scope["type"] == "http" else {}
+        if not headers.get(b"content-type", b"").startswith(b"multipart/"):
+            await self.app(scope, receive, send)
+            return
+        try:
+            declared = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            declared = 0
+        if declared > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if exceeded and not started:
+                return  # replaced by the 413 below
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not started:
+            await self._reject(send)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": f"Request body too large (max {format_size(self.max_bytes)})"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"connection", b"close")]
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -1,4 +1,6 @@
 from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+from datetime import datetime
 from fastapi import UploadFile
 
 class AdminIn(BaseModel):
@@ -12,3 +14,22 @@ class EmployeeIn(BaseModel):
 class ConfigIn(BaseModel):
     camera_enter: str
     camera_exit: str
+
+class EventIn(BaseModel):
+    empid: str
+    action: Literal["IN", "OUT"]
+    timestamp: Optional[datetime] = None
+    camera: Optional[str] = Field(None, max_length=50)
+    event_id: Optional[str] = Field(None, max_length=64)
+
+class CameraIn(BaseModel):
+    camera_id: str = Field(..., max_length=50)
+    url: str = Field(..., max_length=255)
+    direction: Literal["enter", "exit"]
+    site: str = Field("default", max_length=50)
+    enabled: bool = True
+
+class MatchIn(BaseModel):
+    embeddings: List[List[float]]
+    top_k: Optional[int] = Field(None, ge=1, le=100)
+    threshold: Optional[float] = Field(None, ge=-1, le=1)
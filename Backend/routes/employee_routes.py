@@ -1,25 +1,44 @@
 # routers/employee.py
-from fastapi import APIRouter, Depends, HTTPException,UploadFile,File,Form,Request,Query,Response
-from models import Employee,TimeLog 
-from pydantic_models import EmployeeIn
-from utils import authenticate_user,verify_password,create_token,authenticate_employee
+from fastapi import APIRouter, Depends, HTTPException,UploadFile,File,Form,Request,Query,Response,BackgroundTasks
+from models import Employee,TimeLog
+from pydantic_models import EmployeeIn, EventIn
+from ingest import write_event, event_writer, QueueFull
+from debounce import debouncer
+from photos import photo_index, save_upload, UploadTooLarge, PHOTOS_BASE_PATH, MAX_UPLOAD_BYTES, format_size
+from thumbnails import thumbnail_cache, THUMBNAIL_SIZES
+from embedding_manifest import photo_manifest
+from pagination import parse_fields, prefix_search, fetch_page, MAX_PAGE_SIZE
+import asyncio
+from utils import authenticate_user,verify_password,hash_password,create_token,authenticate_employee,to_local_time
+from utils import resolve_employee_id,resolve_employee_ids,invalidate_employee,employee_id_cache
+from attendance import get_attendance_range, refresh_attendance, as_stored, iter_days, present_ids_query, present_counts_query
+from attendance import export_attendance, EXPORT_FIELDS
 import shutil
+import csv
+import io
+import json
 import dotenv
 import os
 from uuid import uuid4
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from tortoise.exceptions import DoesNotExist
 from datetime import datetime, timedelta, date
+from typing import List, Optional
 from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
 from zoneinfo import ZoneInfo 
 import random
 import string
-from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
 dotenv.load_dotenv()
 UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER")
 ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/png", "image/jpg", "image/webp"}
+MAX_BATCH_EVENTS = int(os.getenv("MAX_BATCH_EVENTS", "1000"))
+MAX_PHOTOS_PER_REQUEST = int(os.getenv("MAX_PHOTOS_PER_REQUEST", "50"))
+EXPORT_CHUNK_ROWS = 500  # rows per chunk written to the export response
+EMPLOYEE_FIELDS = ("id", "empid", "name", "email", "photoUrl", "thumbUrls")
+PHOTO_FIELDS = ("photoUrl", "thumbUrls")
 
 
 LOCAL_TIMEZONE = ZoneInfo("Asia/Kolkata")  # replace with yours
@@ -35,12 +54,106 @@ def format_duration(seconds: int):
     hours = seconds // 3600
     minutes = (seconds % 3600) // 60
     return f"{hours}h {minutes}m"
-PHOTOS_BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..','..', 'photos'))
 print(f"Photos base path: {PHOTOS_BASE_PATH}")
 
 from fastapi import APIRouter, Request, HTTPException, Depends
 import os
 
+def check_image_type(file: UploadFile):
+    if file.content_type not in ALLOWED_IMAGE_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file type: {file.filename} ({file.content_type})"
+        )
+
+
+async def store_photo(empid: str, file: UploadFile):
+    # Stream one upload into the employee's photo folder and index it
+    try:
+        filename = await save_upload(file, os.path.join(UPLOAD_FOLDER, str(empid)))
+    except UploadTooLarge:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large: {file.filename} (max {format_size(MAX_UPLOAD_BYTES)})"
+        )
+    photo_index.add(empid, filename)
+    await photo_manifest.mark_dirty(empid)
+    return filename
+
+
+async def remove_photo(empid: str, filename: str):
+    photo_index.remove(empid, filename)
+    await photo_manifest.mark_dirty(empid)
+    try:
+        await asyncio.to_thread(os.remove, os.path.join(UPLOAD_FOLDER, str(empid), filename))
+    except FileNotFoundError:
+        pass
+
+
+def photo_urls(request: Request, empid: str):
+    emp_id = str(empid)
+    return [request.url_for("photos", path=f"{emp_id}/{filename}")._url for filename in photo_index.list(emp_id)]
+
+
+def thumbnail_urls(request: Request, empid: str, filename: str):
+    return {
+        str(size): request.url_for("thumbnail", size=size, empid=str(empid), filename=filename)._url
+        for size in THUMBNAIL_SIZES
+    }
+
+
+@router.get("/thumb/{size}/{empid}/{filename}", name="thumbnail")
+async def get_thumbnail(size: int, empid: str, filename: str):
+    if size not in THUMBNAIL_SIZES or not photo_index.contains(empid, filename):
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    path = await asyncio.to_thread(thumbnail_cache.get, size, empid, filename)
+    if not path:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=86400"})
+
+
+@router.post("/photos/rescan")
+async def rescan_photos(username=Depends(authenticate_user)):
+    # Rebuild the photo index from disk, e.g. after files were changed by hand
+    return await asyncio.to_thread(photo_index.rescan)
+
+
+@router.get("/export")
+async def export_attendance_range(
+    start_date: date = Query(...),
+    end_date: date = Query(...),
+    format: str = Query("csv"),
+    username=Depends(authenticate_user)
+):
+    # Every employee-day in the range as CSV or NDJSON, streamed as it is paired
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+
+    async def rows():
+        chunk = io.StringIO()
+        writer = csv.DictWriter(chunk, fieldnames=EXPORT_FIELDS)
+        if format == "csv":
+            writer.writeheader()
+        count = 0
+        async for row in export_attendance(start_date, end_date):
+            if format == "csv":
+                writer.writerow(row)
+            else:
+                chunk.write(json.dumps(row) + "\n")
+            count += 1
+            if count % EXPORT_CHUNK_ROWS == 0:
+                yield chunk.getvalue()
+                chunk.seek(0)
+                chunk.truncate()
+        yield chunk.getvalue()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"attendance_{start_date}_{end_date}.{format}"
+    return StreamingResponse(rows(), media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 @router.get("/{id}")
 async def get_employee(id: str, request: Request, username=Depends(authenticate_user)):
     employee = await Employee.get_or_none(empid=id).values("id","empid", "name", "email")
@@ -48,49 +161,51 @@ async def get_employee(id: str, request: Request, username=Depends(authenticate_
     if not employee:
         raise HTTPException(status_code=404, detail="Employee not found")
 
-    emp_id = str(employee["empid"])
-    photo_dir = os.path.join(PHOTOS_BASE_PATH, emp_id)
-
-    photo_urls = []
-    if os.path.isdir(photo_dir):
-        files = os.listdir(photo_dir)
-        image_files = [f for f in files if f.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))]
-        for filename in image_files:
-            url = request.url_for("photos", path=f"{emp_id}/{filename}")
-            photo_urls.append(url._url)
-
-    employee["photos"] = photo_urls  # Send all photos as list
+    employee["photos"] = photo_urls(request, employee["empid"])  # Send all photos as list
+    employee["thumbnails"] = [thumbnail_urls(request, employee["empid"], filename) for filename in photo_index.list(employee["empid"])]
     return {"employee": employee}
 
 
 @router.get("/")
-async def get_employees(request: Request, username=Depends(authenticate_user)):
-    employees = await Employee.all().values("id","empid", "name", "email")
-    
-    if not employees:
+async def get_employees(
+    request: Request,
+    cursor: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    q: Optional[str] = Query(None, min_length=1, max_length=100),
+    username=Depends(authenticate_user)
+):
+    # Paged by id when limit is given (pass nextCursor back as cursor), with
+    # an optional name/empid/email prefix search and a fields= projection.
+    fields = parse_fields(fields, EMPLOYEE_FIELDS)
+    columns = tuple(field for field in fields if field not in PHOTO_FIELDS)
+    wants_photos = any(field in PHOTO_FIELDS for field in fields)
+    if wants_photos and "empid" not in columns:
+        columns += ("empid",)
+
+    query = Employee.all()
+    if q:
+        query = query.filter(prefix_search(q, ("name", "empid", "email")))
+    employees, next_cursor = await fetch_page(query, columns, cursor, limit)
+
+    if not employees and cursor is None and limit is None and not q:
         raise HTTPException(status_code=404, detail="No employees found")
 
-    enriched_employees = []
     for emp in employees:
-        emp_id = str(emp["empid"])
-        photo_dir = os.path.join(PHOTOS_BASE_PATH, emp_id)
-
-        photo_url = None
-        if os.path.isdir(photo_dir):
-            files = os.listdir(photo_dir)
-            image_files = [f for f in files if f.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))]
-            if image_files:
-                # Use url_for to generate full URL
-                photo_url = request.url_for("photos", path=f"{emp_id}/{image_files[0]}")
-
-        emp["photoUrl"] = photo_url._url
-        enriched_employees.append(emp)
-
-    return {"employees": enriched_employees}
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        if wants_photos:
+            emp_id = str(emp["empid"])
+            first_photo = photo_index.first(emp_id)
+            if "photoUrl" in fields:
+                emp["photoUrl"] = request.url_for("photos", path=f"{emp_id}/{first_photo}")._url if first_photo else None
+            if "thumbUrls" in fields:
+                emp["thumbUrls"] = thumbnail_urls(request, emp_id, first_photo) if first_photo else None
+            if "empid" not in fields:
+                del emp["empid"]
+
+    return {"employees": employees, "nextCursor": next_cursor}
 
 @router.post("/")
-async def create_employee(name:str=Form(...), email:str=Form(...),file:UploadFile=File(...),empid:str=Form(...),username = Depends(authenticate_user)):
+async def create_employee(background_tasks: BackgroundTasks, name:str=Form(...), email:str=Form(...),file:UploadFile=File(...),empid:str=Form(...),username = Depends(authenticate_user)):
     if not name or not email or not file or not empid:
         raise HTTPException(status_code=400, detail="Name, email, file, and id are required")
     exiting_employee = await Employee.get_or_none(empid=empid)
@@ -100,23 +215,21 @@ async def create_employee(name:str=Form(...), email:str=Form(...),file:UploadFil
     if exiting_employee:
         raise HTTPException(status_code=400, detail="Employee with this email already exists")
     
+    check_image_type(file)
+
     password = ''.join(random.choices(string.ascii_letters + string.digits, k=6))
-    hashed_password = pwd_context.hash(password)
+    hashed_password = await hash_password(password)
     employee_obj = await Employee.create(name=name, email=email,empid=empid,password=hashed_password)
+    invalidate_employee(empid)
     if not employee_obj:
         raise HTTPException(status_code=400, detail="Employee creation failed")
-    emp_dir = os.path.join(UPLOAD_FOLDER, str(employee_obj.empid))
-    os.makedirs(emp_dir, exist_ok=True)
-    if file.content_type not in ALLOWED_IMAGE_TYPES:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Unsupported file type: {file.filename} ({file.content_type})"
-        )   
-    ext = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid4().hex}{ext}"
-    file_path = os.path.join(emp_dir, unique_filename)
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
+    try:
+        unique_filename = await store_photo(employee_obj.empid, file)
+    except HTTPException:
+        await employee_obj.delete()
+        invalidate_employee(empid)
+        raise
+    background_tasks.add_task(thumbnail_cache.generate, empid, unique_filename)
     return {"password":password,"empid":empid,"email":email}
 
 @router.delete("/{id}")
@@ -126,9 +239,13 @@ async def delete_employee(id:str,username = Depends(authenticate_user)):
     if not employee_obj:
         raise HTTPException(status_code=404, detail="Employee not found")
     await employee_obj.delete()
+    invalidate_employee(employee_obj.empid)
     emp_dir = os.path.join(UPLOAD_FOLDER, str(employee_obj.empid))
     if os.path.exists(emp_dir):
         shutil.rmtree(emp_dir)
+    photo_index.drop(employee_obj.empid)
+    await photo_manifest.mark_dirty(employee_obj.empid)
+    await asyncio.to_thread(thumbnail_cache.discard, employee_obj.empid)
     return {"deleted"}
 from typing import Optional
 from fastapi import Form
@@ -161,6 +278,9 @@ async def update_employee(
         new_dir = os.path.join(UPLOAD_FOLDER, str(empid))
         if os.path.exists(old_dir):
             os.rename(old_dir, new_dir)
+        photo_index.rename(old_empid, empid)
+        await photo_manifest.mark_dirty(old_empid, empid)
+        await asyncio.to_thread(thumbnail_cache.discard, old_empid)
 
     # Update fields
     employee_obj.name = name
@@ -169,9 +289,10 @@ async def update_employee(
 
     # ✅ Update password only if not empty/None
     if password:
-        employee_obj.password = pwd_context.hash(password)
+        employee_obj.password = await hash_password(password)
 
     await employee_obj.save()
+    invalidate_employee(old_empid, empid)
 
     return {"emp": {"empid": employee_obj.empid, "name": employee_obj.name, "email": employee_obj.email}}
 
@@ -183,46 +304,50 @@ async def get_employee_photos(id: str, request: Request, username=Depends(authen
     if not employee:
         raise HTTPException(status_code=404, detail="Employee not found")
 
-    emp_id = str(employee["empid"])
-    photo_dir = os.path.join(PHOTOS_BASE_PATH, emp_id)
-
-    photo_urls = []
-    if os.path.isdir(photo_dir):
-        files = os.listdir(photo_dir)
-        image_files = [f for f in files if f.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))]
-        for filename in image_files:
-            url = request.url_for("photos", path=f"{emp_id}/{filename}")
-            photo_urls.append(url._url)
-
-    return {"urls":photo_urls}
+    return {"urls":photo_urls(request, employee["empid"])}
 
 @router.post("/addphoto/{id}")
-async def add_photo(id:str,request:Request, file:UploadFile=File(...), username = Depends(authenticate_user)):
+async def add_photo(id:str,request:Request, background_tasks: BackgroundTasks, file:UploadFile=File(...), username = Depends(authenticate_user)):
     employee_obj = await Employee.get_or_none(empid=id)
     if not employee_obj:
         raise HTTPException(status_code=404, detail="Employee not found")
 
-    emp_dir = os.path.join(UPLOAD_FOLDER, str(employee_obj.empid))
-    os.makedirs(emp_dir, exist_ok=True)
-
-    if file.content_type not in ALLOWED_IMAGE_TYPES:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Unsupported file type: {file.filename} ({file.content_type})"
-        )   
-
-    ext = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid4().hex}{ext}"
-    file_path = os.path.join(emp_dir, unique_filename)
-
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
+    check_image_type(file)
+    unique_filename = await store_photo(employee_obj.empid, file)
+    background_tasks.add_task(thumbnail_cache.generate, employee_obj.empid, unique_filename)
 
     # Generate public photo URL
     photo_url = request.url_for("photos", path=f"{employee_obj.empid}/{unique_filename}")._url
 
     return {"photo_url": photo_url}
 
+@router.post("/addphotos/{id}")
+async def add_photos(id:str,request:Request, background_tasks: BackgroundTasks, files:List[UploadFile]=File(...), username = Depends(authenticate_user)):
+    employee_obj = await Employee.get_or_none(empid=id)
+    if not employee_obj:
+        raise HTTPException(status_code=404, detail="Employee not found")
+    if len(files) > MAX_PHOTOS_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PHOTOS_PER_REQUEST} photos per request")
+    for file in files:
+        check_image_type(file)
+
+    # Write all uploads concurrently; if any fails, undo the ones that landed
+    results = await asyncio.gather(
+        *(store_photo(employee_obj.empid, file) for file in files),
+        return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    saved = [result for result in results if not isinstance(result, BaseException)]
+    if errors:
+        await asyncio.gather(*(remove_photo(employee_obj.empid, filename) for filename in saved))
+        raise errors[0]
+
+    photo_urls = []
+    for filename in saved:
+        background_tasks.add_task(thumbnail_cache.generate, employee_obj.empid, filename)
+        photo_urls.append(request.url_for("photos", path=f"{employee_obj.empid}/{filename}")._url)
+    return {"photo_urls": photo_urls}
+
 @router.post("/deletephoto/{id}")
 async def delete_photo(id: str,file: str = Form(...),username = Depends(authenticate_user)):
     employee_obj = await Employee.get_or_none(empid=id)
@@ -232,19 +357,21 @@ async def delete_photo(id: str,file: str = Form(...),username = Depends(authenti
     emp_dir = os.path.join(UPLOAD_FOLDER, str(employee_obj.empid))
     file_path = os.path.join(emp_dir, file)
 
-    if not os.path.exists(file_path):
+    if not photo_index.contains(employee_obj.empid, file):
         raise HTTPException(status_code=404, detail="File not found")
-    image_files = [
-        f for f in os.listdir(emp_dir)
-        if os.path.isfile(os.path.join(emp_dir, f))
-           and f.lower().endswith((".png", ".jpg", ".jpeg", ".webp"))
-    ]
-    if len(image_files) <= 1:   
+    if photo_index.count(employee_obj.empid) <= 1:
         raise HTTPException(
             status_code=400,
             detail="At least one photo must remain."
         )
-    os.remove(file_path)
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        photo_index.remove(employee_obj.empid, file)
+        raise HTTPException(status_code=404, detail="File not found")
+    photo_index.remove(employee_obj.empid, file)
+    await photo_manifest.mark_dirty(employee_obj.empid)
+    await asyncio.to_thread(thumbnail_cache.discard, employee_obj.empid, file)
     return {"message": "Photo deleted successfully"}
 
 import pytz
@@ -256,19 +383,30 @@ print(datetime.now(LOCAL_TIMEZONE))
 async def enter(request: Request):
     data = await request.json()
     empid = data.get("empid")
+    camera = data.get("camera")
 
     if not empid:
         return JSONResponse(status_code=400, content={"error": "empid is required"})
+    if camera is not None and (not isinstance(camera, str) or len(camera) > 50):
+        return JSONResponse(status_code=400, content={"error": "camera must be a string of at most 50 characters"})
 
-    try:
-        employee = await Employee.get(empid=empid)
-    except DoesNotExist:
+    employee_id = await resolve_employee_id(empid)
+    if employee_id is None:
         return JSONResponse(status_code=404, content={"error": "Employee not found"})
 
     # get current time in local timezone
     current_time = datetime.now(LOCAL_TIMEZONE)
     print(current_time)
-    await TimeLog.create(employee=employee, action="IN", timestamp=current_time)
+    if not debouncer.allow(empid, "IN", camera, current_time):
+        return {"status": "success", "debounced": True, "message": f"Employee {empid} entry already recorded"}
+    try:
+        await write_event(employee_id, "IN", current_time, camera)
+    except QueueFull:
+        debouncer.forget(empid, "IN", camera)
+        return JSONResponse(status_code=503, content={"error": "Event queue is full, retry later"}, headers={"Retry-After": "1"})
+    except Exception:
+        debouncer.forget(empid, "IN", camera)  # not stored, let the retry through
+        raise
 
     print(f"{empid} Entered at {current_time}!", flush=True)
     return {"status": "success", "message": f"Employee {empid} entered"}
@@ -277,24 +415,117 @@ async def enter(request: Request):
 async def exit(request: Request):
     data = await request.json()
     empid = data.get("empid")
+    camera = data.get("camera")
 
     if not empid:
         return JSONResponse(status_code=400, content={"error": "empid is required"})
+    if camera is not None and (not isinstance(camera, str) or len(camera) > 50):
+        return JSONResponse(status_code=400, content={"error": "camera must be a string of at most 50 characters"})
 
-    try:
-        employee = await Employee.get(empid=empid)
-    except DoesNotExist:
+    employee_id = await resolve_employee_id(empid)
+    if employee_id is None:
         return JSONResponse(status_code=404, content={"error": "Employee not found"})
 
     # get current time in local timezone
     current_time = datetime.now(LOCAL_TIMEZONE)
+    if not debouncer.allow(empid, "OUT", camera, current_time):
+        return {"status": "success", "debounced": True, "message": f"Employee {empid} exit already recorded"}
 
-    await TimeLog.create(employee=employee, action="OUT", timestamp=current_time)
+    try:
+        await write_event(employee_id, "OUT", current_time, camera)
+    except QueueFull:
+        debouncer.forget(empid, "OUT", camera)
+        return JSONResponse(status_code=503, content={"error": "Event queue is full, retry later"}, headers={"Retry-After": "1"})
+    except Exception:
+        debouncer.forget(empid, "OUT", camera)  # not stored, let the retry through
+        raise
 
     print(f"{empid} Exited at {current_time}!", flush=True)
     return {"status": "success", "message": f"Employee {empid} exited"}
 
 
+@router.post("/events/batch")
+async def ingest_events(events: List[EventIn]):
+    if len(events) > MAX_BATCH_EVENTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_EVENTS} events per batch")
+
+    # Resolve every empid from the cache, misses in one query
+    employee_ids = await resolve_employee_ids({event.empid for event in events})
+
+    # Drop event ids we have already stored (client retries) or repeated in this batch
+    event_ids = {event.event_id for event in events if event.event_id}
+    stored = await TimeLog.filter(event_id__in=event_ids).values_list("event_id", "employee_id", "timestamp") if event_ids else []
+    seen = {event_id for event_id, _, _ in stored}
+    # Days of already stored events are refreshed too: if a failed request
+    # left them stale, its retry must not skip them as duplicates
+    days = {(employee_id, as_stored(timestamp).date()) for _, employee_id, timestamp in stored}
+
+    now = datetime.now(LOCAL_TIMEZONE)
+    logs = []
+    sightings = []  # debounce keys recorded for the rows in logs
+    unknown = set()
+    duplicates = 0
+    debounced = 0
+    for event in events:
+        employee_id = employee_ids.get(event.empid)
+        if employee_id is None:
+            unknown.add(event.empid)
+            continue
+        if event.event_id:
+            if event.event_id in seen:
+                duplicates += 1
+                continue
+            seen.add(event.event_id)
+        timestamp = to_local_time(event.timestamp) if event.timestamp else now
+        if not debouncer.allow(event.empid, event.action, event.camera, timestamp):
+            debounced += 1
+            continue
+        sightings.append((event.empid, event.action, event.camera))
+        logs.append(TimeLog(
+            employee_id=employee_id,
+            action=event.action,
+            timestamp=timestamp,
+            camera=event.camera,
+            event_id=event.event_id
+        ))
+
+    logs.sort(key=lambda log: log.timestamp)
+    days |= {(log.employee_id, as_stored(log.timestamp).date()) for log in logs}
+    if days:
+        # One transaction, as in write_event: if the rollup refresh fails the
+        # rows are not kept either. ignore_conflicts covers a retry racing
+        # this request on event_id. Events may be late or out of order, so
+        # the touched days are rebuilt rather than advanced.
+        try:
+            async with in_transaction():
+                if logs:
+                    await TimeLog.bulk_create(logs, ignore_conflicts=True)
+                await refresh_attendance(days)
+        except Exception:
+            for sighting in sightings:
+                debouncer.forget(*sighting)
+            raise
+
+    return {
+        "status": "success",
+        "received": len(events),
+        "accepted": len(logs),
+        "duplicates": duplicates,
+        "debounced": debounced,
+        "unknownEmpids": sorted(unknown)
+    }
+
+
+@router.get("/cache/stats")
+async def get_cache_stats(username=Depends(authenticate_user)):
+    return {"employeeIds": employee_id_cache.stats(), "thumbnails": thumbnail_cache.stats()}
+
+
+@router.get("/ingest/stats")
+async def get_ingest_stats(username=Depends(authenticate_user)):
+    return {"writeBehind": event_writer.stats(), "debounce": debouncer.stats()}
+
+
 @router.get("/attendance/{empid}")
 async def get_attendance_summary(
     empid: str,
@@ -305,108 +536,60 @@ async def get_attendance_summary(
     if not employee:
         return {"error": "Employee not found"}
 
-    result = []
-    today = date.today()
-
-    current = start_date
-    while current <= end_date:
-        next_day = current + timedelta(days=1)
-        logs = await TimeLog.filter(
-            employee=employee,
-            timestamp__gte=datetime.combine(current, datetime.min.time()),
-            timestamp__lt=datetime.combine(next_day, datetime.min.time())
-        ).order_by("timestamp")
-
-        entry_time = None
-        exit_time = None
-        in_time = 0
-        corrupted = False
-        inside = False
-        last_in = None
-        in_out_pairs = []
-
-        for log in logs:
-            if log.action == "IN":
-                if inside:
-                    corrupted = True  # Two consecutive INs
-                else:
-                    last_in = log.timestamp
-                    inside = True
-                    if not entry_time:
-                        entry_time = log.timestamp
-            elif log.action == "OUT":
-                if inside and last_in:
-                    delta = (log.timestamp - last_in).total_seconds()
-                    in_time += delta
-                    in_out_pairs.append((last_in, log.timestamp))
-                    exit_time = log.timestamp
-                    inside = False
-                    last_in = None
-                else:
-                    corrupted = True  # OUT without prior IN
-
-        # Handle unmatched IN (still inside)
-        if inside:
-            if current == today:
-                corrupted = False  # Allow it for today
-                exit_time = None  # Don't set lastExit if still inside
-            else:
-                corrupted = True
-
-        total_span = 0
-        total_out_time = 0
-        if entry_time and exit_time and entry_time < exit_time:
-            total_span = (exit_time - entry_time).total_seconds()
-            total_out_time = total_span - in_time
-         # Python 3.9+
-# Or use `pytz` if you're on Python < 3.9
-
-        
-        result.append({
-            "date": current.strftime("%Y-%m-%d"),
-            "firstEntry": convert_to_local(entry_time).strftime("%I:%M %p") if entry_time else "-",
-            "lastExit": convert_to_local(exit_time).strftime("%I:%M %p") if exit_time else "-",  # will be "-" if still inside today
-            "totalInTime": format_duration(int(in_time)) if entry_time and exit_time else "-",
-            "totalOutTime": format_duration(int(total_out_time)) if entry_time and exit_time else "-",
-            "status": "Present" if entry_time and not corrupted else ("Absent" if not entry_time else "Corrupted")
-        })
+    return await get_attendance_range(employee, start_date, end_date)
 
-        current += timedelta(days=1)
 
-    return result
+@router.get("/summary/range")
+async def get_attendance_summary_by_range(
+    start_date: date = Query(...),
+    end_date: date = Query(...)
+):
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+
+    total_employees = await Employee.all().count()
+
+    # One grouped query over the rollup: present employees per day
+    rows = await present_counts_query(start_date, end_date)
+    present_by_day = {row["date"]: row["present"] for row in rows}
+
+    days = []
+    for day in iter_days(start_date, end_date):
+        present = present_by_day.get(day, 0)
+        days.append({
+            "date": day.strftime("%Y-%m-%d"),
+            "totalPresent": present,
+            "totalAbsent": total_employees - present
+        })
+
+    return {
+        "startDate": start_date.strftime("%Y-%m-%d"),
+        "endDate": end_date.strftime("%Y-%m-%d"),
+        "totalEmployees": total_employees,
+        "days": days
+    }
 
 
 @router.get("/summary/{target_date}")
 async def get_attendance_summary_by_date(target_date: str ):
-    # Get all employees
     try:
         target_date = datetime.strptime(target_date, "%Y-%m-%d").date()
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
 
-    all_employees = await Employee.all()
+    # Employees with at least one "IN" log that day, in a single query
+    present_ids = set(await present_ids_query(target_date))
+
+    all_employees = await Employee.all().values_list("id", "empid", "name")
     total_employees = len(all_employees)
 
     present = []
     absent = []
-
-    for employee in all_employees:
-        # Time range for that day
-        start_dt = datetime.combine(target_date, datetime.min.time())
-        end_dt = datetime.combine(target_date + timedelta(days=1), datetime.min.time())
-
-        # Check if employee has at least one "IN" log
-        log = await TimeLog.filter(
-            employee=employee,
-            action="IN",
-            timestamp__gte=start_dt,
-            timestamp__lt=end_dt
-        ).first()
-
-        if log:
-            present.append({"empid": employee.empid, "name": employee.name})
+    for emp_pk, empid, name in all_employees:
+        if emp_pk in present_ids:
+            present.append({"empid": empid, "name": name})
         else:
-            absent.append({"empid": employee.empid, "name": employee.name})
+            absent.append({"empid": empid, "name": name})
 
     return {
         "date": target_date.strftime("%Y-%m-%d"),
@@ -423,7 +606,7 @@ async def login(response:Response,empid:str=Form(...),password:str=Form(...)):
     employee = await Employee.get_or_none(
         Q(empid=empid) | Q(email=empid)
     )
-    if not employee or not verify_password(password, employee.password):
+    if not employee or not await verify_password(password, employee.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_token({"empid": employee.empid})
     response.set_cookie(
@@ -449,15 +632,15 @@ async def change_password(
         raise HTTPException(status_code=404, detail="Employee not found")
 
     # Verify old password
-    if not pwd_context.verify(old_password, employee.password):
+    if not await verify_password(old_password, employee.password):
         raise HTTPException(status_code=401, detail="Incorrect old password")
 
-    # Prevent using the same password again
-    if pwd_context.verify(new_password, employee.password):
+    # Prevent using the same password again (old_password is known to match)
+    if new_password == old_password:
         raise HTTPException(status_code=400, detail="New password must be different from the old password")
 
     # Hash and update the password
-    employee.password = pwd_context.hash(new_password)
+    employee.password = await hash_password(new_password)
     await employee.save()
 
     return {"message": "Password changed successfully"}
@@ -1,18 +1,20 @@
 
-from fastapi import APIRouter, Depends, HTTPException,UploadFile,File,Form,Request
+from fastapi import APIRouter, Depends, HTTPException,UploadFile,File,Form,Request,Query
 
-from utils import authenticate_user
+from utils import authenticate_user, is_valid_rtsp_url
 import dotenv
 import os
-from models import Environment
+from typing import Optional
+from models import Environment, Camera
+from pydantic_models import CameraIn, MatchIn
+from supervisor import supervisor
+from streaming import camera_prober
+from jobs import embedding_jobs, JobConflict
+from embedding_store import embedding_store
+from matching import matcher, MATCH_THRESHOLD, MATCH_TOP_K, MAX_MATCH_QUERIES
+import json
 import subprocess
 from fastapi.responses import StreamingResponse
-enter_proc = None
-exit_proc = None
-MODEL_PATH = os.getenv("MODEL_PATH")
-ENV_PATH = os.getenv("ENV_PATH")
-EMBD_PATH = os.getenv("EMBD_PATH")
-PHOTOS_PATH = os.getenv("PHOTOS_PATH")
 dotenv.load_dotenv()
 
 router = APIRouter(
@@ -24,54 +26,107 @@ import subprocess
 import os
 import asyncio
 
-@router.post("/start")
-async def start_model(username=Depends(authenticate_user)):
-    global enter_proc, exit_proc
-    print("start")
-    try:
-        venv_python = os.path.abspath(ENV_PATH)
-        model_script = os.path.abspath(MODEL_PATH)
+async def seed_cameras_from_config():
+    # Before the registry existed the two cameras lived in the CAMERA_ENTER /
+    # CAMERA_EXIT environment keys; register them on first start.
+    Camera_Enter = await Environment.get_or_none(key="CAMERA_ENTER")
+    Camera_Exit = await Environment.get_or_none(key="CAMERA_EXIT")
+    for camera_id, env in (("enter", Camera_Enter), ("exit", Camera_Exit)):
+        if env and env.value:
+            await Camera.get_or_create(camera_id=camera_id, defaults={"url": env.value, "direction": camera_id})
 
-        Camera_Enter = await Environment.get_or_none(key="CAMERA_ENTER")
-        Camera_Exit = await Environment.get_or_none(key="CAMERA_EXIT")
 
-        enter_url = Camera_Enter.value if Camera_Enter else None
-        exit_url = Camera_Exit.value if Camera_Exit else None
+async def save_config_cameras(camera_enter: str, camera_exit: str):
+    # /configure edits the "enter" and "exit" cameras of the registry (the
+    # Environment keys are kept in step for older readers). A worker already
+    # running for one of them is restarted on the new URL.
+    cameras = []
+    for camera_id, url in (("enter", camera_enter), ("exit", camera_exit)):
+        camera, _ = await Camera.update_or_create(camera_id=camera_id, defaults={"url": url, "direction": camera_id})
+        await Environment.update_or_create(key=f"CAMERA_{camera_id.upper()}", defaults={"value": url})
+        cameras.append(camera)
+        await sync_worker(camera)
+    return cameras
 
-        if not enter_url or not exit_url:
-            return {"error": "CAMERA_ENTER or CAMERA_EXIT URL not found."}
 
-        # Start both models (capture stdout)
-        enter_proc = subprocess.Popen(
-            [venv_python, model_script, 'enter', enter_url],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True
-        )
+async def sync_worker(camera: Camera):
+    # Bring a running worker in line with its edited registry row: stopped
+    # when the camera was disabled, restarted when its settings changed.
+    if camera.camera_id not in supervisor.workers:
+        return
+    if camera.enabled:
+        await supervisor.start([camera])
+    else:
+        await supervisor.stop([camera.camera_id])
 
-        exit_proc = subprocess.Popen(
-            [venv_python, model_script, 'exit', exit_url],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True
-        )
 
-        # Async wait for "streaming - " line from both
-        async def wait_for_start(proc, label):
-            while True:
-                line = await asyncio.to_thread(proc.stdout.readline)
-                if not line:
-                    break
-                print(f"[{label}] {line.strip()}")
-                if "streaming -" in line:
-                    break;
-
-        await asyncio.gather(
-            wait_for_start(enter_proc, "enter"),
-            wait_for_start(exit_proc, "exit")
-        )
+async def config_camera_urls():
+    # (enter URL, exit URL) from the registry, falling back to the Environment keys
+    urls = dict(await Camera.filter(camera_id__in=["enter", "exit"]).values_list("camera_id", "url"))
+    for camera_id, key in (("enter", "CAMERA_ENTER"), ("exit", "CAMERA_EXIT")):
+        if camera_id not in urls:
+            env = await Environment.get_or_none(key=key)
+            urls[camera_id] = env.value if env else None
+    return urls["enter"], urls["exit"]
+
+
+@router.get("/cameras")
+async def list_cameras(site: Optional[str] = None, username=Depends(authenticate_user)):
+    cameras = Camera.all().order_by("site", "camera_id")
+    if site:
+        cameras = cameras.filter(site=site)
+    return {"cameras": await cameras.values("camera_id", "url", "direction", "site", "enabled")}
+
+
+@router.post("/cameras")
+async def save_camera(camera: CameraIn, username=Depends(authenticate_user)):
+    if not is_valid_rtsp_url(camera.url):
+        raise HTTPException(status_code=400, detail="Invalid RTSP URL")
+    if camera.camera_id in ("enter", "exit"):
+        # The /configure cameras: same superuser check and fresh probe as there
+        if username != "superuser":
+            raise HTTPException(status_code=403, detail="Forbidden")
+        probe = await camera_prober.probe(camera.url, refresh=True)
+        if not probe["reachable"]:
+            raise HTTPException(status_code=400, detail=f"Camera {camera.camera_id} stream is not accessible: {probe['error']}")
+    camera_obj, created = await Camera.update_or_create(
+        camera_id=camera.camera_id,
+        defaults=camera.model_dump(exclude={"camera_id"})
+    )
+    if camera.camera_id in ("enter", "exit"):
+        await Environment.update_or_create(key=f"CAMERA_{camera.camera_id.upper()}", defaults={"value": camera.url})
+    await sync_worker(camera_obj)
+    return {"camera": camera.model_dump(), "created": created}
+
+
+@router.delete("/cameras/{camera_id}")
+async def delete_camera(camera_id: str, username=Depends(authenticate_user)):
+    camera_obj = await Camera.get_or_none(camera_id=camera_id)
+    if not camera_obj:
+        raise HTTPException(status_code=404, detail="Camera not found")
+    await supervisor.stop([camera_id])
+    await camera_obj.delete()
+    return {"message": "Camera deleted successfully"}
+
+
+@router.post("/start")
+async def start_model(site: Optional[str] = None, username=Depends(authenticate_user)):
+    print("start")
+    try:
+        if not await Camera.exists():
+            await seed_cameras_from_config()
+
+        cameras = Camera.filter(enabled=True)
+        if site:
+            cameras = cameras.filter(site=site)
+        cameras = await cameras
+        if not cameras:
+            return {"error": "No cameras configured."}
+
+        # One supervised worker per camera, waits until they are streaming
+        await supervisor.start(cameras)
         print("done")
-        return {"status": "success", "message": "Both models started and streaming."}
+        return {"status": "success", "message": f"{len(cameras)} camera worker(s) started.", "cameras": supervisor.status()}
 
     except Exception as e:
         return {"status": "error", "details": str(e)}
@@ -79,88 +134,126 @@ async def start_model(username=Depends(authenticate_user)):
     
 @router.get("/status")
 async def check_model_status(username=Depends(authenticate_user)):
-    global enter_proc, exit_proc
-
     try:
-        enter_running = enter_proc and enter_proc.poll() is None
-        exit_running = exit_proc and exit_proc.poll() is None
+        cameras = supervisor.status()
+        running = [camera for camera in cameras if camera["state"] == "running"]
 
-        if enter_running and exit_running:
-            return {"status": "running"}
-        elif not enter_running and not exit_running:
-            return {"status": "stopped"}
+        if cameras and len(running) == len(cameras):
+            status = "running"
+        elif not running:
+            status = "stopped"
         else:
-            return {"status": "partial", "details": {
-                "enter": "running" if enter_running else "stopped",
-                "exit": "running" if exit_running else "stopped"
-            }}
+            status = "partial"
+        return {"status": status, "cameras": cameras}
     except Exception as e:
         return {"status": "error", "details": str(e)}
 
     
 @router.post("/stop")
-async def stop_model(username=Depends(authenticate_user)):
-    global enter_proc, exit_proc
-    results = {}
-
+async def stop_model(camera_id: Optional[str] = None, username=Depends(authenticate_user)):
     try:
-        if enter_proc and enter_proc.poll() is None:
-            enter_proc.terminate()
-            enter_proc.wait()
-            results["enter"] = "terminated"
-        else:
-            results["enter"] = "not running"
-
-        if exit_proc and exit_proc.poll() is None:
-            exit_proc.terminate()
-            exit_proc.wait()
-            results["exit"] = "terminated"
-        else:
-            results["exit"] = "not running"
-
+        results = await supervisor.stop([camera_id] if camera_id else None)
         return {"status": "success", "results": results}
 
     except Exception as e:
         return {"status": "error", "details": str(e)}
     
 
-@router.post("/generate-embeddings")
-async def generate_embeddings(username=Depends(authenticate_user)):
+@router.get("/logs/{camera_id}")
+async def get_model_logs(camera_id: str, lines: int = Query(200, ge=1, le=10000), follow: bool = False, username=Depends(authenticate_user)):
+    logs = supervisor.logs.get(camera_id)
+    if logs is None:
+        raise HTTPException(status_code=404, detail="No logs for this camera")
+    if not follow:
+        return {"camera_id": camera_id, "lines": logs.tail(lines)}
+
+    async def events():
+        async for line in logs.follow(lines):
+            yield ": keepalive\n\n" if line is None else f"data: {line}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.post("/generate-embeddings", status_code=202)
+async def generate_embeddings(full: bool = True, username=Depends(authenticate_user)):
+    # Runs in the background, poll /model/jobs/{job_id} or follow its events.
+    # full=false embeds only employees whose photos changed since the last
+    # build; the script must follow the contract described in jobs.py.
     try:
-        directory = os.path.abspath(PHOTOS_PATH)
-        venv_python = os.path.abspath(ENV_PATH)
-        model_script = os.path.abspath(EMBD_PATH)
-
-        process = subprocess.Popen(
-            [venv_python, model_script, directory],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
+        job = embedding_jobs.submit(username, full)
+    except JobConflict as e:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Embedding generation is already running (job {e.job.id})"
         )
+    return {
+        "status": "accepted",
+        "message": f"Embedding generation started by user {username}.",
+        "job_id": job.id,
+        "mode": job.mode
+    }
 
-        logs = []
-        while True:
-            line = process.stdout.readline()
-            if line == "" and process.poll() is not None:
-                break
-            if line:
-                logs.append(line.strip())
-
-        stderr_output = process.stderr.read()
-        if process.returncode != 0:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Embedding generation failed:\n{stderr_output.strip()}"
-            )
-
-        return {
-            "status": "success",
-            "message": f"Embedding generation completed successfully by user {username}.",
-            "logs": logs
-        }
 
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"An unexpected error occurred: {str(e)}"
-        )
\ No newline at end of file
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, lines: int = Query(50, ge=0, le=2000), username=Depends(authenticate_user)):
+    job = embedding_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.status(lines)
+
+
+@router.get("/jobs/{job_id}/events")
+async def follow_job(job_id: str, username=Depends(authenticate_user)):
+    job = embedding_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        async for line in job.logs.follow(0):
+            if line is None:
+                yield ": keepalive\n\n"
+                continue
+            payload = {"state": job.state, "progress": job.progress(), "line": line}
+            yield f"event: progress\ndata: {json.dumps(payload)}\n\n"
+        yield f"event: done\ndata: {json.dumps(job.status(0))}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/embeddings/version")
+async def get_embeddings_version():
+    # Polled by the recognition workers (like /employee/enter, without a login):
+    # when "version" changes they np.load(path, mmap_mode="r") the new matrix
+    # and swap it in without restarting.
+    version = await asyncio.to_thread(embedding_store.current)
+    if version is None:
+        raise HTTPException(status_code=404, detail="No embeddings have been published yet")
+    return version.info()
+
+
+@router.post("/match")
+async def match_embeddings(body: MatchIn):
+    # Top-k empids with cosine scores for each query embedding, scored as one
+    # batch against the current gallery. Called by the recognition workers.
+    if not body.embeddings:
+        raise HTTPException(status_code=400, detail="No embeddings given")
+    if len(body.embeddings) > MAX_MATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_MATCH_QUERIES} embeddings per request")
+    if len({len(embedding) for embedding in body.embeddings}) != 1:
+        raise HTTPException(status_code=400, detail="All embeddings must have the same length")
+    top_k = body.top_k or MATCH_TOP_K
+    threshold = MATCH_THRESHOLD if body.threshold is None else body.threshold
+    try:
+        version, results = await asyncio.to_thread(matcher.match, body.embeddings, top_k, threshold)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if version is None:
+        raise HTTPException(status_code=404, detail="No embeddings have been published yet")
+    return {
+        "version": version,
+        "threshold": threshold,
+        "results": [
+            {"empid": matches[0]["empid"] if matches else None, "matches": matches}
+            for matches in results
+        ]
+    }
@@ -0,0 +1,102 @@
+from tortoise import Tortoise
+
+# generate_schemas(safe=True) only creates missing tables, so columns and
+# indexes declared after a table already exists never reach the database.
+# ensure_schema() fills that gap for the additive changes we make: new
+# nullable columns and new (unique) indexes.
+
+
+def declared_indexes(model):
+    # (columns, unique) for Meta.indexes and index=True / unique=True fields
+    meta = model._meta
+    wanted = []
+    for index in meta.indexes:
+        wanted.append((tuple(meta.fields_map[name].source_field or name for name in index), False))
+    for name, field in meta.fields_map.items():
+        if field.pk or name not in meta.fields_db_projection:
+            continue
+        column = meta.fields_db_projection[name]
+        if getattr(field, "unique", False):
+            wanted.append(((column,), True))
+        elif getattr(field, "index", False):
+            wanted.append(((column,), False))
+    return wanted
+
+
+async def existing_indexes(conn, table: str):
+    rows = await conn.execute_query_dict(
+        "SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+        "ORDER BY INDEX_NAME, SEQ_IN_INDEX",
+        [table],
+    )
+    indexes = {}
+    for row in rows:
+        columns, _ = indexes.setdefault(row["INDEX_NAME"], ([], not int(row["NON_UNIQUE"])))
+        columns.append(row["COLUMN_NAME"])
+    return [(tuple(columns), unique) for columns, unique in indexes.values()]
+
+
+async def existing_columns(conn, table: str):
+    rows = await conn.execute_query_dict(
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        [table],
+    )
+    return {row["COLUMN_NAME"] for row in rows}
+
+
+def is_covered(columns, unique, existing):
+    for index_columns, index_unique in existing:
+        if unique and index_unique and index_columns == columns:
+            return True
+        if not unique and index_columns[:len(columns)] == columns:
+            return True
+    return False
+
+
+async def ensure_columns(conn, model):
+    # Add nullable columns missing from an existing table
+    meta = model._meta
+    table = meta.db_table
+    existing = await existing_columns(conn, table)
+    created = []
+    for name, column in meta.fields_db_projection.items():
+        field = meta.fields_map[name]
+        if column in existing or not field.null:
+            continue
+        sql_type = field.get_for_dialect("mysql", "SQL_TYPE")
+        await conn.execute_script(f"ALTER TABLE `{table}` ADD COLUMN `{column}` {sql_type} NULL")
+        created.append(column)
+        print(f"Added column {table}.{column}", flush=True)
+    return created
+
+
+async def ensure_indexes(conn, model):
+    # Create any declared index that is not covered by an existing one
+    table = model._meta.db_table
+    existing = await existing_indexes(conn, table)
+    created = []
+    for columns, unique in declared_indexes(model):
+        if is_covered(columns, unique, existing):
+            continue
+        name = f"{'uid' if unique else 'idx'}_{table}_{'_'.join(columns)}"[:64]
+        column_sql = ", ".join(f"`{column}`" for column in columns)
+        kind = "UNIQUE INDEX" if unique else "INDEX"
+        await conn.execute_script(f"CREATE {kind} `{name}` ON `{table}` ({column_sql})")
+        existing.append((columns, unique))
+        created.append(name)
+        print(f"Created index {name} on {table}({column_sql})", flush=True)
+    return created
+
+
+async def ensure_schema(connection_name: str = "default"):
+    conn = Tortoise.get_connection(connection_name)
+    if conn.capabilities.dialect != "mysql":
+        return []
+
+    created = []
+    for model in Tortoise.apps["models"].values():
+        created += await ensure_columns(conn, model)
+        created += await ensure_indexes(conn, model)
+    return created
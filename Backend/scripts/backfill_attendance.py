@@ -0,0 +1,39 @@
+# Build the DailyAttendance rollup from existing TimeLog history.
+# Run from the Backend directory:
+#   python -m scripts.backfill_attendance [--empid SDNA001] [--start 2025-01-01 --end 2025-01-31]
+import argparse
+from datetime import date
+from tortoise import Tortoise, run_async
+from models import Employee
+from attendance import rebuild_attendance
+
+
+async def main(args):
+    await Tortoise.init(config_file="tortoise_config.json")
+    await Tortoise.generate_schemas(safe=True)
+
+    employees = Employee.all().order_by("id")
+    if args.empid:
+        employees = employees.filter(empid=args.empid)
+
+    total = 0
+    for emp_id, empid in await employees.values_list("id", "empid"):
+        days = await rebuild_attendance(emp_id, args.start, args.end)
+        total += days
+        print(f"{empid}: {days} day(s) rebuilt", flush=True)
+    print(f"Done, {total} day(s) rebuilt")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backfill the DailyAttendance rollup from TimeLog")
+    parser.add_argument("--empid", help="only rebuild this employee")
+    parser.add_argument("--start", type=date.fromisoformat, help="first day to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="last day to rebuild (YYYY-MM-DD)")
+    args = parser.parse_args()
+    if bool(args.start) != bool(args.end):
+        parser.error("--start and --end must be given together")
+    return args
+
+
+if __name__ == "__main__":
+    run_async(main(parse_args()))
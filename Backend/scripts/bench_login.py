@@ -0,0 +1,65 @@
+# Login-burst benchmark: bcrypt verification inline on the event loop vs the
+# shipped utils.verify_password and its password worker pool. Reports
+# logins/second and the longest event loop stall seen by a 10ms heartbeat
+# (what enter/exit requests would wait). --workers sets PASSWORD_HASH_WORKERS,
+# otherwise the value from the environment / .env is used.
+# Run from the Backend directory:
+#   python -m scripts.bench_login --logins 50 --workers 4
+import argparse
+import asyncio
+import os
+import time
+
+HEARTBEAT = 0.01
+
+
+async def heartbeat(stop: asyncio.Event, stalls: list):
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(HEARTBEAT)
+        now = time.perf_counter()
+        stalls.append(now - last - HEARTBEAT)
+        last = now
+
+
+async def run(label, logins, hashed, verify):
+    stop = asyncio.Event()
+    stalls = []
+    ticker = asyncio.create_task(heartbeat(stop, stalls))
+    await asyncio.sleep(HEARTBEAT * 2)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(verify("password123", hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await ticker
+    assert all(results)
+    print(f"{label:<10} {logins / elapsed:8.1f} logins/s   max loop stall {max(stalls) * 1000:8.1f} ms")
+
+
+async def main(args):
+    if args.workers:
+        os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+    # Imported once the pool size is set: utils builds the pool on import
+    from utils import pwd_context, hash_password, verify_password, PASSWORD_HASH_WORKERS
+
+    hashed = await hash_password("password123")
+
+    async def inline(plain, hashed):
+        return pwd_context.verify(plain, hashed)
+
+    print(f"{args.logins} concurrent logins")
+    await run("inline", args.logins, hashed, inline)
+    await run(f"pool({PASSWORD_HASH_WORKERS})", args.logins, hashed, verify_password)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark bcrypt login throughput")
+    parser.add_argument("--logins", type=int, default=50, help="concurrent logins in the burst")
+    parser.add_argument("--workers", type=int, help="PASSWORD_HASH_WORKERS for this run")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,76 @@
+# Face-matching benchmark on synthetic galleries: one query at a time (a
+# dot product and full sort per detection) vs GalleryIndex scoring the whole
+# batch with one matrix multiply and argpartition. Also checks both agree.
+# Run from the Backend directory:
+#   python -m scripts.bench_match --identities 1000 10000 100000 --batch 64
+import argparse
+import time
+import numpy as np
+from embedding_store import normalize
+from matching import GalleryIndex
+
+
+def synthetic_gallery(rng, identities: int, per_identity: int, dim: int):
+    centers = normalize(rng.standard_normal((identities, dim), dtype=np.float32))
+    rows = np.repeat(centers, per_identity, axis=0)
+    rows += 0.1 * rng.standard_normal(rows.shape, dtype=np.float32) / np.sqrt(dim)
+    labels = np.repeat([f"EMP{i:06d}" for i in range(identities)], per_identity)
+    return centers, normalize(rows), labels
+
+
+def per_query(matrix, labels, queries, top_k, threshold):
+    results = []
+    for query in normalize(queries):
+        scores = matrix @ query
+        best = {}
+        for i in np.argsort(-scores):
+            if labels[i] not in best:
+                best[labels[i]] = float(scores[i])
+                if len(best) == top_k:
+                    break
+        results.append([empid for empid, score in best.items() if score >= threshold])
+    return results
+
+
+def timed(fn, repeat):
+    fn()  # warm up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat, result
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    print(f"dim {args.dim}, {args.per_identity} photo(s) per identity, batch {args.batch}, top {args.top_k}")
+    print(f"{'identities':>10} {'loop ms':>10} {'batched ms':>11} {'speedup':>8} {'queries/s':>11}")
+    for identities in args.identities:
+        centers, matrix, labels = synthetic_gallery(rng, identities, args.per_identity, args.dim)
+        picks = rng.integers(0, identities, args.batch)
+        queries = centers[picks] + 0.3 * rng.standard_normal((args.batch, args.dim), dtype=np.float32) / np.sqrt(args.dim)
+
+        index = GalleryIndex(matrix, labels)
+        loop_time, expected = timed(lambda: per_query(matrix, labels, queries, args.top_k, args.threshold), args.repeat)
+        batch_time, results = timed(lambda: index.search(queries, args.top_k, args.threshold), args.repeat)
+        assert [[m["empid"] for m in row] for row in results] == expected, "batched results differ"
+        assert all(row and row[0]["empid"] == labels[pick * args.per_identity] for row, pick in zip(results, picks))
+        print(
+            f"{identities:>10} {loop_time * 1000:>10.1f} {batch_time * 1000:>11.1f} "
+            f"{loop_time / batch_time:>7.1f}x {args.batch / batch_time:>11.0f}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark batched face matching")
+    parser.add_argument("--identities", type=int, nargs="+", default=[1000, 10000, 100000], help="gallery sizes")
+    parser.add_argument("--per-identity", type=int, default=1, help="embeddings per identity")
+    parser.add_argument("--dim", type=int, default=512, help="embedding dimension")
+    parser.add_argument("--batch", type=int, default=64, help="query embeddings per request")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,130 @@
+# Smoke check of the event ingest path: drives /employee/enter, /employee/exit
+# and /employee/events/batch through the real router against a throwaway
+# SQLite database and checks the TimeLog rows and the DailyAttendance rollup.
+# Run from the Backend directory (needs aiosqlite and httpx):
+#   python -m scripts.check_ingest
+import asyncio
+from datetime import datetime, timedelta
+import httpx
+from fastapi import FastAPI
+from tortoise import Tortoise
+from models import Employee, TimeLog, DailyAttendance
+import attendance
+import ingest
+import routes.employee_routes as employee_routes
+from routes.employee_routes import router as employee_router, LOCAL_TIMEZONE
+
+
+def check(condition, message):
+    if not condition:
+        raise SystemExit(f"FAIL: {message}")
+    print(f"ok   {message}")
+
+
+async def main():
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["models"]})
+    await Tortoise.generate_schemas()
+    app = FastAPI()
+    app.include_router(employee_router)
+    employee = await Employee.create(empid="CHECK001", name="Check", email="check@example.com", password="-")
+
+    try:
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://check") as client:
+            # A failed write must not leave the sighting behind to debounce the retry
+            write_event = employee_routes.write_event
+
+            async def failing_write(*args):
+                raise RuntimeError("database is down")
+            employee_routes.write_event = failing_write
+            response = await client.post("/employee/enter", json={"empid": "CHECK001", "camera": "door-1"})
+            employee_routes.write_event = write_event
+            check(response.status_code == 500, f"failed write returns 500 ({response.status_code})")
+
+            response = await client.post("/employee/enter", json={"empid": "CHECK001", "camera": "door-1"})
+            check(response.status_code == 200 and not response.json().get("debounced"), f"retried enter accepted ({response.status_code})")
+            response = await client.post("/employee/enter", json={"empid": "CHECK001", "camera": "door-1"})
+            check(response.status_code == 200 and response.json().get("debounced"), "repeated enter is debounced")
+            response = await client.post("/employee/exit", json={"empid": "CHECK001", "camera": "door-2"})
+            check(response.status_code == 200 and not response.json().get("debounced"), f"exit accepted ({response.status_code})")
+            response = await client.post("/employee/enter", json={"empid": "NOBODY"})
+            check(response.status_code == 404, "unknown empid is rejected")
+            response = await client.post("/employee/enter", json={})
+            check(response.status_code == 400, "missing empid is rejected")
+
+            yesterday = datetime.now(LOCAL_TIMEZONE) - timedelta(days=1)
+            response = await client.post("/employee/events/batch", json=[
+                {"empid": "CHECK001", "action": "IN", "timestamp": yesterday.replace(hour=9).isoformat(), "event_id": "check-1"},
+                {"empid": "CHECK001", "action": "OUT", "timestamp": yesterday.replace(hour=17).isoformat(), "event_id": "check-2"},
+                {"empid": "CHECK001", "action": "OUT", "timestamp": yesterday.replace(hour=17).isoformat(), "event_id": "check-2"},
+            ])
+            body = response.json()
+            check(response.status_code == 200 and body["accepted"] == 2 and body["duplicates"] == 1, f"batch accepted 2, skipped 1 duplicate ({body})")
+
+            # A failed batch refresh must roll its rows back, and a retried
+            # duplicate must still bring its day up to date
+            refresh_attendance = employee_routes.refresh_attendance
+
+            async def failing_refresh(*args):
+                raise RuntimeError("rollup refresh failed")
+            employee_routes.refresh_attendance = failing_refresh
+            earlier = datetime.now(LOCAL_TIMEZONE) - timedelta(days=2)
+            batch = [{"empid": "CHECK001", "action": "IN", "timestamp": earlier.replace(hour=10).isoformat(), "event_id": "check-3", "camera": "door-4"}]
+            response = await client.post("/employee/events/batch", json=batch)
+            employee_routes.refresh_attendance = refresh_attendance
+            check(response.status_code == 500 and not await TimeLog.filter(event_id="check-3").exists(), "failed batch refresh leaves no TimeLog row")
+            response = await client.post("/employee/events/batch", json=batch)
+            check(response.status_code == 200 and response.json()["accepted"] == 1, f"retried batch accepted ({response.status_code})")
+
+            await DailyAttendance.filter(employee_id=employee.id, date=earlier.date()).delete()
+            response = await client.post("/employee/events/batch", json=batch)
+            check(response.json()["duplicates"] == 1, "retried batch is a duplicate")
+            check(await DailyAttendance.filter(employee_id=employee.id, date=earlier.date(), inside=True).exists(), "duplicate's day is refreshed")
+
+        # A failed rollup update must roll the TimeLog insert back with it
+        record_event = ingest.record_event
+
+        async def failing_record(*args):
+            raise RuntimeError("rollup update failed")
+        ingest.record_event = failing_record
+        try:
+            await ingest.write_event(employee.id, "IN", datetime.now(LOCAL_TIMEZONE), "door-3")
+        except RuntimeError:
+            pass
+        ingest.record_event = record_event
+        check(not await TimeLog.filter(camera="door-3").exists(), "failed rollup update leaves no TimeLog row")
+
+        logs = await TimeLog.filter(employee_id=employee.id).order_by("timestamp").values_list("action", "camera")
+        check(logs == [("IN", "door-4"), ("IN", None), ("OUT", None), ("IN", "door-1"), ("OUT", "door-2")], f"TimeLog rows {logs}")
+        rows = await DailyAttendance.filter(employee_id=employee.id).order_by("date")
+        check(len(rows) == 3, f"{len(rows)} rollup day(s)")
+        check(all(row.first_entry and row.last_exit and not row.inside and not row.corrupted for row in rows[1:]), "rollup days are paired")
+        check(rows[1].in_seconds == 8 * 3600, f"batch day has 8h inside ({rows[1].in_seconds}s)")
+
+        # The incremental rollup must agree with a rebuild from TimeLog
+        other = await Employee.create(empid="CHECK002", name="Other", email="other@example.com", password="-")
+        day = datetime.now(LOCAL_TIMEZONE) - timedelta(days=3)
+        events = [(9, 0, "IN"), (12, 30, "OUT"), (13, 15, "IN"), (17, 0, "OUT")]
+        for hour, minute, action in events:
+            timestamp = day.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            log = await TimeLog.create(employee_id=other.id, action=action, timestamp=timestamp)
+            await attendance.record_event(other.id, timestamp, action)
+        # SQLite keeps the offset, MySQL DATETIME keeps only the wall-clock
+        # value: a fresh timestamp only survives MySQL if it already has the
+        # offset a stored one is read back with
+        stored = (await TimeLog.get(id=log.id)).timestamp
+        fresh = attendance.as_stored(timestamp)
+        check(fresh == stored and fresh.utcoffset() == stored.utcoffset(), f"fresh timestamps take the stored shape ({fresh} vs {stored})")
+        fields = ("date", "first_entry", "last_exit", "last_in", "in_seconds", "inside", "corrupted")
+        incremental = await DailyAttendance.filter(employee_id=other.id).values_list(*fields)
+        await attendance.rebuild_attendance(other.id)
+        rebuilt = await DailyAttendance.filter(employee_id=other.id).values_list(*fields)
+        check(incremental == rebuilt, f"record_event matches rebuild_attendance ({incremental} vs {rebuilt})")
+        check(rebuilt[0][4] == 7 * 3600 + 15 * 60, f"multi-hour day has 7h15m inside ({rebuilt[0][4]}s)")
+    finally:
+        await Tortoise.close_connections()
+    print("All ingest checks passed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+# Run EXPLAIN on the attendance and summary read queries to check they use
+# the TimeLog / DailyAttendance indexes. Run from the Backend directory:
+#   python -m scripts.explain_queries --empid SDNA001 --start 2025-01-01 --end 2025-01-31
+import argparse
+from datetime import date
+from tortoise import Tortoise, run_async
+from models import Employee
+from schema import ensure_schema
+from attendance import timelog_range_query, rollup_range_query, present_ids_query, present_counts_query
+
+
+async def explain(conn, label, queryset):
+    sql = queryset.sql()
+    rows = await conn.execute_query_dict("EXPLAIN " + sql)
+    print(f"\n== {label}\n{sql}")
+    ok = True
+    for row in rows:
+        print(f"  table={row.get('table')} type={row.get('type')} key={row.get('key')} "
+              f"rows={row.get('rows')} extra={row.get('Extra')}")
+        if row.get("type") == "ALL" or not row.get("key"):
+            ok = False
+    if not ok:
+        print("  WARNING: full scan, no index used")
+    return ok
+
+
+async def main(args):
+    await Tortoise.init(config_file="tortoise_config.json")
+    await Tortoise.generate_schemas(safe=True)
+    await ensure_schema()
+    conn = Tortoise.get_connection("default")
+
+    employee = await Employee.get_or_none(empid=args.empid) if args.empid else await Employee.first()
+    emp_pk = employee.id if employee else 0
+
+    results = [
+        await explain(conn, "attendance rollup (per employee, date range)",
+                      rollup_range_query(emp_pk, args.start, args.end)),
+        await explain(conn, "attendance rebuild (per employee, timestamp range)",
+                      timelog_range_query(emp_pk, args.start, args.end)),
+        await explain(conn, "daily summary (distinct IN per day)",
+                      present_ids_query(args.start)),
+        await explain(conn, "range summary (present per day)",
+                      present_counts_query(args.start, args.end)),
+    ]
+    print(f"\n{sum(results)}/{len(results)} queries use an index")
+
+
+def parse_args():
+    today = date.today()
+    parser = argparse.ArgumentParser(description="EXPLAIN the attendance and summary queries")
+    parser.add_argument("--empid", help="employee to plan the per-employee queries for (default: first)")
+    parser.add_argument("--start", type=date.fromisoformat, default=today.replace(day=1), help="YYYY-MM-DD")
+    parser.add_argument("--end", type=date.fromisoformat, default=today, help="YYYY-MM-DD")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run_async(main(parse_args()))
@@ -0,0 +1,35 @@
+# Publish embeddings produced outside a /model/generate-embeddings job into
+# the versioned embedding store. Run from the Backend directory:
+#   python -m scripts.import_embeddings embeddings.npy labels.json [--merge] [--drop SDNA001 ...]
+import argparse
+import json
+import numpy as np
+from embedding_store import embedding_store
+
+
+def main(args):
+    matrix = np.load(args.matrix)
+    with open(args.labels) as f:
+        labels = json.load(f)
+    if isinstance(labels, dict):
+        labels = labels["labels"]
+
+    if args.merge:
+        version = embedding_store.merge(matrix, labels, args.drop)
+    else:
+        version = embedding_store.publish(matrix, labels)
+    info = version.info()
+    print(f"Published {info['version']}: {info['count']} embeddings, {info['identities']} identities, dim {info['dim']}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Publish an embedding matrix to the embedding store")
+    parser.add_argument("matrix", help=".npy file with one embedding per row")
+    parser.add_argument("labels", help="JSON list of the empid of each row")
+    parser.add_argument("--merge", action="store_true", help="replace only these empids in the current version")
+    parser.add_argument("--drop", nargs="*", default=[], help="empids to remove when merging")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,326 @@
+import asyncio
+import os
+import threading
+import time
+from typing import NamedTuple
+import cv2
+import dotenv
+from caches import BoundedCache
+
+dotenv.load_dotenv()
+STREAM_MAX_WIDTH = int(os.getenv("STREAM_MAX_WIDTH", "1280"))
+STREAM_FPS = float(os.getenv("STREAM_FPS", "10"))
+STREAM_JPEG_QUALITY = int(os.getenv("STREAM_JPEG_QUALITY", "70"))
+SNAPSHOT_TTL = float(os.getenv("SNAPSHOT_TTL", "2"))  # seconds
+SNAPSHOT_TIMEOUT = float(os.getenv("SNAPSHOT_TIMEOUT", "10"))  # seconds
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "5"))  # seconds
+PROBE_CACHE_TTL = float(os.getenv("PROBE_CACHE_TTL", "30"))  # seconds
+
+
+class StreamProfile(NamedTuple):
+    max_width: int  # 0 = native width
+    fps: float  # 0 = every decoded frame
+    quality: int  # JPEG quality, 1-100
+
+
+DEFAULT_PROFILE = StreamProfile(STREAM_MAX_WIDTH, STREAM_FPS, STREAM_JPEG_QUALITY)
+
+
+def multipart_frame(jpeg: bytes):
+    return (
+        b'--frame\r\n'
+        b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
+    )
+
+
+def encode_frame(frame, max_width: int, quality: int):
+    # Downscale before encoding, JPEG cost grows with pixel count
+    height, width = frame.shape[:2]
+    if max_width and width > max_width:
+        frame = cv2.resize(frame, (max_width, max(1, round(height * max_width / width))), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes() if ok else None
+
+
+class _ProfileState:
+    def __init__(self):
+        self.frame = None
+        self.seq = 0
+        self.subscribers = 0
+        self.last_encoded = 0.0
+        self.waiters = set()
+
+
+class FrameHub:
+    # One capture thread per RTSP URL. Each distinct StreamProfile asked for by
+    # a subscriber gets its own latest-JPEG slot, encoded at most profile.fps
+    # times a second; frames nobody is due for are grabbed but never decoded.
+    # Subscribers are woken when their slot changes and send whatever is
+    # newest, so a slow client skips frames instead of queueing them.
+    def __init__(self, url: str):
+        self.url = url
+        self.closed = False
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"frame-hub {url}", daemon=True)
+
+    @property
+    def subscribers(self):
+        with self._lock:
+            return sum(state.subscribers for state in self._profiles.values())
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def add_subscriber(self, profile: StreamProfile):
+        with self._lock:
+            state = self._profiles.get(profile)
+            if state is None:
+                state = self._profiles[profile] = _ProfileState()
+            state.subscribers += 1
+            return state
+
+    def remove_subscriber(self, profile: StreamProfile):
+        with self._lock:
+            state = self._profiles[profile]
+            state.subscribers -= 1
+            if state.subscribers == 0:
+                del self._profiles[profile]
+            return sum(state.subscribers for state in self._profiles.values())
+
+    def _due(self, now: float):
+        with self._lock:
+            return [
+                (profile, state) for profile, state in self._profiles.items()
+                if not profile.fps or now - state.last_encoded >= 1 / profile.fps
+            ]
+
+    def _run(self):
+        cap = cv2.VideoCapture(self.url)
+        try:
+            if not cap.isOpened():
+                print(f"Error: Cannot open stream {self.url}")
+                return
+            while not self._stop.is_set():
+                # grab() demuxes without decoding; only decode when a profile is due
+                if not cap.grab():
+                    break
+                now = time.monotonic()
+                due = self._due(now)
+                if not due:
+                    continue
+                success, frame = cap.retrieve()
+                if not success:
+                    break
+                encoded = {}
+                for profile, state in due:
+                    key = (profile.max_width, profile.quality)
+                    if key not in encoded:
+                        encoded[key] = encode_frame(frame, profile.max_width, profile.quality)
+                    if encoded[key]:
+                        state.last_encoded = now
+                        self._publish(state, encoded[key])
+        finally:
+            cap.release()
+            with self._lock:
+                self.closed = True
+                states = list(self._profiles.values())
+            for state in states:
+                self._notify(state)
+
+    def _publish(self, state: _ProfileState, jpeg: bytes):
+        with self._lock:
+            state.frame = jpeg
+            state.seq += 1
+        self._notify(state)
+
+    def _notify(self, state: _ProfileState):
+        with self._lock:
+            waiters = list(state.waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    async def frames(self, state: _ProfileState):
+        # Async generator of the newest JPEGs for one profile until the capture ends
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            state.waiters.add(waiter)
+        try:
+            last_seq = 0
+            while True:
+                waiter[1].clear()
+                with self._lock:
+                    frame, seq, closed = state.frame, state.seq, self.closed
+                if seq != last_seq:
+                    last_seq = seq
+                    yield frame
+                elif closed:
+                    return
+                else:
+                    await waiter[1].wait()
+        finally:
+            with self._lock:
+                state.waiters.discard(waiter)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "url": self.url,
+                "closed": self.closed,
+                "profiles": [
+                    {**profile._asdict(), "subscribers": state.subscribers}
+                    for profile, state in self._profiles.items()
+                ]
+            }
+
+
+class FrameHubRegistry:
+    # Hubs by URL, created on first subscriber and stopped after the last one
+    # leaves. Only used from the event loop.
+    def __init__(self):
+        self._hubs = {}
+
+    def get(self, url: str):
+        hub = self._hubs.get(url)
+        return hub if hub and not hub.closed else None
+
+    async def subscribe(self, url: str, profile: StreamProfile = DEFAULT_PROFILE):
+        hub = self.get(url)
+        if hub is None:
+            hub = self._hubs[url] = FrameHub(url)
+            hub.start()
+        state = hub.add_subscriber(profile)
+        try:
+            async for jpeg in hub.frames(state):
+                yield multipart_frame(jpeg)
+        finally:
+            if hub.remove_subscriber(profile) == 0:
+                hub.stop()
+                if self._hubs.get(url) is hub:
+                    del self._hubs[url]
+
+    def stats(self):
+        return [hub.stats() for hub in self._hubs.values()]
+
+
+frame_hubs = FrameHubRegistry()
+
+
+def grab_frame(url: str):
+    # Open, read one frame, release. Blocking, run it in a worker thread.
+    cap = open_capture(url, SNAPSHOT_TIMEOUT)
+    try:
+        if not cap.isOpened():
+            return None
+        success, frame = cap.read()
+        return frame if success else None
+    finally:
+        cap.release()
+
+
+class SnapshotCache:
+    # Latest still per camera for dashboard tiles. Only encoded JPEGs are kept,
+    # per (url, max_width, quality) for ttl seconds; concurrent misses for one
+    # URL share a single grab-and-release capture, whose decoded frame is
+    # dropped once they have encoded it.
+    def __init__(self, ttl: float, timeout: float):
+        self.timeout = timeout
+        self.grabs = 0
+        self._jpegs = BoundedCache(maxsize=256, ttl=ttl)
+        self._inflight = {}
+
+    async def get(self, url: str, max_width: int, quality: int):
+        key = (url, max_width, quality)
+        jpeg = self._jpegs.get(key)
+        if jpeg is None:
+            frame = await self._frame(url)
+            if frame is None:
+                return None
+            jpeg = await asyncio.to_thread(encode_frame, frame, max_width, quality)
+            if jpeg:
+                # Expired stills are otherwise only dropped when looked up again
+                self._jpegs.prune()
+                self._jpegs.set(key, jpeg)
+        return jpeg
+
+    async def _frame(self, url: str):
+        task = self._inflight.get(url)
+        if task is None:
+            task = self._inflight[url] = asyncio.ensure_future(self._grab(url))
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        # shield: one caller timing out must not cancel the grab for the others
+        return await asyncio.wait_for(asyncio.shield(task), self.timeout)
+
+    async def _grab(self, url: str):
+        self.grabs += 1
+        return await asyncio.to_thread(grab_frame, url)
+
+    def stats(self):
+        return {"grabs": self.grabs, "jpegs": self._jpegs.stats()}
+
+
+snapshots = SnapshotCache(SNAPSHOT_TTL, SNAPSHOT_TIMEOUT)
+
+
+def open_capture(url: str, timeout: float = None):
+    # Pass open/read timeouts to the FFmpeg backend where this OpenCV has them
+    if timeout and hasattr(cv2, "CAP_PROP_OPEN_TIMEOUT_MSEC"):
+        msec = int(timeout * 1000)
+        return cv2.VideoCapture(url, cv2.CAP_FFMPEG, [
+            cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, msec,
+            cv2.CAP_PROP_READ_TIMEOUT_MSEC, msec,
+        ])
+    return cv2.VideoCapture(url)
+
+
+def probe_camera(url: str, timeout: float):
+    # Blocking: open the stream, read one frame, report what we saw
+    started = time.monotonic()
+    cap = open_capture(url, timeout)
+    try:
+        open_ms = round((time.monotonic() - started) * 1000)
+        if not cap.isOpened():
+            return {"reachable": False, "error": "Cannot open stream", "openMs": open_ms}
+        success, frame = cap.read()
+        if not success:
+            return {"reachable": False, "error": "No frame received", "openMs": open_ms}
+        height, width = frame.shape[:2]
+        return {"reachable": True, "width": width, "height": height, "openMs": open_ms}
+    finally:
+        cap.release()
+
+
+class CameraProber:
+    # Reachability checks run in worker threads with a hard deadline, results
+    # cached per URL for ttl seconds. A probe that misses the deadline is
+    # reported unreachable; its thread is left to finish on its own.
+    def __init__(self, ttl: float, timeout: float):
+        self.timeout = timeout
+        self._results = BoundedCache(maxsize=256, ttl=ttl)
+        self._inflight = {}
+
+    async def probe(self, url: str, refresh: bool = False):
+        result = None if refresh else self._results.get(url)
+        if result is not None:
+            return {**result, "cached": True}
+
+        task = self._inflight.get(url)
+        if task is None:
+            task = self._inflight[url] = asyncio.ensure_future(asyncio.to_thread(probe_camera, url, self.timeout))
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            result = {"reachable": False, "error": f"No answer within {self.timeout:g}s"}
+        self._results.set(url, result)
+        return {**result, "cached": False}
+
+    async def probe_many(self, urls, refresh: bool = False):
+        return await asyncio.gather(*(self.probe(url, refresh) for url in urls))
+
+
+camera_prober = CameraProber(PROBE_CACHE_TTL, PROBE_TIMEOUT)
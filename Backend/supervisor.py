@@ -0,0 +1,260 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+import dotenv
+from embedding_store import EMBEDDING_STORE_PATH
+
+dotenv.load_dotenv()
+MODEL_PATH = os.getenv("MODEL_PATH")
+ENV_PATH = os.getenv("ENV_PATH")
+RESTART_BACKOFF_MIN = float(os.getenv("WORKER_RESTART_BACKOFF_MIN", "1"))  # seconds
+RESTART_BACKOFF_MAX = float(os.getenv("WORKER_RESTART_BACKOFF_MAX", "60"))  # seconds
+STABLE_AFTER = float(os.getenv("WORKER_STABLE_AFTER", "60"))  # seconds up before backoff resets
+START_TIMEOUT = float(os.getenv("WORKER_START_TIMEOUT", "60"))  # seconds
+STOP_TIMEOUT = 10  # seconds before a worker that ignores SIGTERM is killed
+WORKER_LOG_LINES = int(os.getenv("WORKER_LOG_LINES", "1000"))
+LOG_KEEPALIVE = 15  # seconds between SSE comments while a log is quiet
+LOG_LINE_LIMIT = 1024 * 1024  # longest worker output line kept, bytes
+
+
+class LogBuffer:
+    # Bounded ring of a worker's most recent output lines. Appended to from
+    # the drain thread, read and followed from the event loop.
+    def __init__(self, maxlen: int):
+        self.lines = deque(maxlen=maxlen)
+        self.total = 0  # lines ever appended, used as a cursor by followers
+        self.closed = False  # no more lines will come, followers stop
+        self._lock = threading.Lock()
+        self._waiters = set()
+
+    def append(self, line: str):
+        with self._lock:
+            self.lines.append(line)
+            self.total += 1
+        self._notify()
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+        self._notify()
+
+    def _notify(self):
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def tail(self, count: int = None):
+        with self._lock:
+            lines = list(self.lines)
+        if count is None:
+            return lines
+        return lines[-count:] if count > 0 else []
+
+    def since(self, cursor: int):
+        # Lines appended after cursor (those still in the ring), and the new cursor
+        with self._lock:
+            new = min(self.total - cursor, len(self.lines))
+            return list(self.lines)[len(self.lines) - new:] if new > 0 else [], self.total
+
+    async def follow(self, count: int = None):
+        # Async generator: the last count lines, then every new line as it arrives
+        # until the buffer is closed. Yields None after LOG_KEEPALIVE quiet
+        # seconds so callers can ping.
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+            cursor = self.total
+        try:
+            for line in self.tail(count):
+                yield line
+            while True:
+                waiter[1].clear()
+                closed = self.closed
+                lines, cursor = self.since(cursor)
+                for line in lines:
+                    yield line
+                if closed:
+                    return
+                if not lines:
+                    try:
+                        await asyncio.wait_for(waiter[1].wait(), LOG_KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        yield None
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+
+class CameraWorker:
+    # One recognition process for one camera, restarted until stopped
+    def __init__(self, camera_id: str, url: str, direction: str, site: str, logs: LogBuffer):
+        self.camera_id = camera_id
+        self.url = url
+        self.direction = direction
+        self.site = site
+        self.proc = None
+        self.task = None
+        self.state = "starting"
+        self.restarts = 0
+        self.last_exit_code = None
+        self.started_at = None
+        self.stopping = False
+        self.stopped = asyncio.Event()  # set by stop, cuts a restart backoff short
+        self.ready = asyncio.Event()  # first start attempt has streamed or died
+        self.logs = logs
+
+    @property
+    def running(self):
+        return self.proc is not None and self.proc.returncode is None
+
+    async def spawn(self):
+        # asyncio subprocess: waiting on it and reading its output need no
+        # thread, so the number of cameras is not bounded by the default executor
+        return await asyncio.create_subprocess_exec(
+            os.path.abspath(ENV_PATH), os.path.abspath(MODEL_PATH), self.direction, self.url,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            limit=LOG_LINE_LIMIT,
+            env={**os.environ, "CAMERA_ID": self.camera_id, "CAMERA_SITE": self.site, "EMBEDDING_STORE": EMBEDDING_STORE_PATH}
+        )
+
+    def status(self):
+        return {
+            "camera_id": self.camera_id,
+            "direction": self.direction,
+            "site": self.site,
+            "state": self.state,
+            "pid": self.proc.pid if self.running else None,
+            "restarts": self.restarts,
+            "lastExitCode": self.last_exit_code,
+            "uptime": round(time.time() - self.started_at) if self.running and self.started_at else None
+        }
+
+
+class WorkerSupervisor:
+    # Runs one CameraWorker per camera and restarts crashed workers with
+    # exponential backoff (reset once a worker has stayed up STABLE_AFTER s).
+    def __init__(self):
+        self.workers = {}
+        self.logs = {}  # camera_id -> LogBuffer, kept across restarts and stops
+
+    def log_buffer(self, camera_id: str):
+        if camera_id not in self.logs:
+            self.logs[camera_id] = LogBuffer(WORKER_LOG_LINES)
+        return self.logs[camera_id]
+
+    async def start(self, cameras):
+        # cameras: Camera rows. Returns once every new worker is streaming or
+        # START_TIMEOUT has passed.
+        started = []
+        for camera in cameras:
+            worker = self.workers.get(camera.camera_id)
+            if worker and not worker.task.done():
+                if (worker.url, worker.direction, worker.site) == (camera.url, camera.direction, camera.site):
+                    continue
+                await self.stop([camera.camera_id])  # camera was reconfigured
+            worker = CameraWorker(camera.camera_id, camera.url, camera.direction, camera.site, self.log_buffer(camera.camera_id))
+            worker.task = asyncio.create_task(self._supervise(worker))
+            self.workers[camera.camera_id] = worker
+            started.append(worker)
+        if started:
+            waits = [asyncio.ensure_future(worker.ready.wait()) for worker in started]
+            _, pending = await asyncio.wait(waits, timeout=START_TIMEOUT)
+            for wait in pending:
+                wait.cancel()
+        return started
+
+    async def stop(self, camera_ids=None):
+        ids = list(self.workers) if camera_ids is None else [i for i in camera_ids if i in self.workers]
+        results = await asyncio.gather(*(self._stop_worker(self.workers[i]) for i in ids))
+        for camera_id in ids:
+            del self.workers[camera_id]
+        return dict(zip(ids, results))
+
+    async def _stop_worker(self, worker: CameraWorker):
+        # The supervise task is never cancelled mid-spawn (that would orphan
+        # the new process); it sees stopping, terminates what it started and exits.
+        worker.stopping = True
+        worker.stopped.set()
+        was_running = worker.running
+        if was_running:
+            worker.proc.terminate()
+        try:
+            await asyncio.wait_for(asyncio.shield(worker.task), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            if worker.running:
+                worker.proc.kill()
+            await worker.task
+        worker.state = "stopped"
+        return "terminated" if was_running else "not running"
+
+    async def _supervise(self, worker: CameraWorker):
+        backoff = RESTART_BACKOFF_MIN
+        while not worker.stopping:
+            try:
+                worker.proc = await worker.spawn()
+            except OSError as e:
+                print(f"[{worker.camera_id}] cannot start worker: {e}", flush=True)
+                worker.proc = None
+                worker.ready.set()
+            else:
+                worker.state = "starting"
+                worker.started_at = time.time()
+                if worker.stopping:
+                    worker.proc.terminate()  # stop arrived while spawning
+                # Drain stdout for the whole life of the process; a worker
+                # whose pipe fills up blocks on write and stops recognizing.
+                drain = asyncio.create_task(self._drain(worker, worker.proc))
+                worker.last_exit_code = await worker.proc.wait()
+                # A grandchild may still hold the pipe open, don't wait on it forever
+                _, pending = await asyncio.wait([drain], timeout=STOP_TIMEOUT)
+                for task in pending:
+                    task.cancel()
+                worker.ready.set()
+                print(f"[{worker.camera_id}] worker exited with code {worker.last_exit_code}", flush=True)
+                if worker.stopping:
+                    break
+                if time.time() - worker.started_at >= STABLE_AFTER:
+                    backoff = RESTART_BACKOFF_MIN
+
+            worker.state = "restarting"
+            worker.restarts += 1
+            try:
+                await asyncio.wait_for(worker.stopped.wait(), backoff)
+            except asyncio.TimeoutError:
+                pass
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+        worker.state = "stopped"
+
+    async def _drain(self, worker: CameraWorker, proc):
+        # Reads until the process closes stdout. Output is echoed to the
+        # console until the model reports "streaming -".
+        streaming = False
+        while True:
+            try:
+                line = await proc.stdout.readline()
+            except ValueError:
+                continue  # line longer than LOG_LINE_LIMIT, dropped
+            if not line:
+                break
+            line = line.decode(errors="replace").rstrip()
+            worker.logs.append(line)
+            if not streaming:
+                print(f"[{worker.camera_id}] {line}")
+                if "streaming -" in line:
+                    streaming = True
+                    self._mark_running(worker, proc)
+
+    def _mark_running(self, worker: CameraWorker, proc):
+        if worker.proc is proc and proc.returncode is None:
+            worker.state = "running"
+        worker.ready.set()
+
+    def status(self):
+        return [worker.status() for worker in self.workers.values()]
+
+
+supervisor = WorkerSupervisor()
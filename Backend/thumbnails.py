@@ -0,0 +1,120 @@
+import os
+import shutil
+import threading
+import cv2
+import dotenv
+from uuid import uuid4
+from photos import PHOTOS_BASE_PATH
+
+dotenv.load_dotenv()
+THUMBNAIL_SIZES = (64, 128, 256)  # longest edge, px
+THUMBNAIL_QUALITY = 85
+THUMBS_PATH = os.path.abspath(os.getenv("THUMBS_PATH") or os.path.join(os.path.dirname(__file__), '..', 'thumbs'))
+THUMBS_MAX_BYTES = int(os.getenv("THUMBS_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+class ThumbnailCache:
+    # On-disk cache of resized JPEG variants: <root>/<size>/<empid>/<photo>.jpg
+    # Variants are rendered on first request (or eagerly after an upload) and
+    # the least recently used ones are evicted once the cache passes max_bytes.
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._total = None
+        self._lock = threading.Lock()
+
+    def path(self, size: int, empid: str, filename: str):
+        return os.path.join(self.root, str(size), str(empid), os.path.splitext(filename)[0] + ".jpg")
+
+    def get(self, size: int, empid: str, filename: str):
+        # Path of the variant, rendering it if needed. None if the photo is gone.
+        target = self.path(size, empid, filename)
+        try:
+            os.utime(target)  # mark as recently used for eviction
+            return target
+        except FileNotFoundError:
+            pass
+        if not self._render(os.path.join(PHOTOS_BASE_PATH, str(empid), filename), target, size):
+            return None
+        self._evict()
+        return target
+
+    def generate(self, empid: str, filename: str):
+        for size in THUMBNAIL_SIZES:
+            self.get(size, empid, filename)
+
+    def discard(self, empid: str, filename: str = None):
+        for size in THUMBNAIL_SIZES:
+            if filename:
+                self._remove(self.path(size, empid, filename))
+            else:
+                folder = os.path.join(self.root, str(size), str(empid))
+                if os.path.isdir(folder):
+                    for entry in os.scandir(folder):
+                        self._remove(entry.path)
+                    shutil.rmtree(folder, ignore_errors=True)
+
+    def _render(self, source: str, target: str, size: int):
+        image = cv2.imread(source, cv2.IMREAD_COLOR)
+        if image is None:
+            return False
+        height, width = image.shape[:2]
+        scale = size / max(height, width)
+        if scale < 1:
+            image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+        if not ok:
+            return False
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp = f"{target}.{uuid4().hex}.tmp"
+        with open(temp, "wb") as f:
+            f.write(buffer.tobytes())
+        os.replace(temp, target)
+        with self._lock:
+            if self._total is not None:
+                self._total += len(buffer)
+        return True
+
+    def _remove(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._total is not None:
+                self._total -= size
+
+    def _files(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _evict(self):
+        with self._lock:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self._files())
+            if self._total <= self.max_bytes:
+                return
+            # Drop least recently used variants down to 90% of the budget
+            for _, size, path in sorted(self._files()):
+                if self._total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                    self._total -= size
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {"bytes": self._total, "maxBytes": self.max_bytes, "sizes": list(THUMBNAIL_SIZES)}
+
+
+thumbnail_cache = ThumbnailCache(THUMBS_PATH, THUMBS_MAX_BYTES)
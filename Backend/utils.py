@@ -2,14 +2,15 @@ from fastapi import Request, HTTPException
 from jose import JWTError, jwt
 import dotenv
 import os
-import time
-import cv2
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import re
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from datetime import datetime, timedelta, timezone
 from models import Admin,Employee
 from zoneinfo import ZoneInfo 
+from caches import BoundedCache
 
 dotenv.load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
@@ -19,8 +20,26 @@ LOCAL_TIMEZONE = ZoneInfo("Asia/Kolkata")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-def verify_password(plain_password, hashed):
-    return pwd_context.verify(plain_password, hashed)
+# empid -> Employee primary key, for the enter/exit hot path. The employee
+# routes invalidate entries on create, update and delete.
+employee_id_cache = BoundedCache(maxsize=int(os.getenv("EMPLOYEE_CACHE_SIZE", "10000")))
+
+# access token -> resolved identity, see resolve_identity
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))  # seconds
+identity_cache = BoundedCache(maxsize=int(os.getenv("AUTH_CACHE_SIZE", "10000")), ttl=AUTH_CACHE_TTL)
+
+# bcrypt is deliberately slow (hundreds of ms per call), so hashing and
+# verification run in a bounded thread pool instead of on the event loop.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+async def hash_password(password: str):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, pwd_context.hash, password)
+
+async def verify_password(plain_password, hashed):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, pwd_context.verify, plain_password, hashed)
 
 def create_token(data: dict):
     to_encode = data.copy()
@@ -30,75 +49,99 @@ def convert_to_local(dt):
      # treat naive as UTC
     return dt.astimezone(LOCAL_TIMEZONE)
 
+def to_local_time(dt):
+    # naive timestamps are taken to be local already
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=LOCAL_TIMEZONE)
+    return dt.astimezone(LOCAL_TIMEZONE)
+
 def format_duration(seconds: int):
     hours = seconds // 3600
     minutes = (seconds % 3600) // 60
     return f"{hours}h {minutes}m"
 
-async def authenticate_user(request:Request):
-    time.sleep(0.5)  # Simulate some processing delay
+async def resolve_employee_id(empid: str):
+    employee_id = employee_id_cache.get(empid)
+    if employee_id is None:
+        employee_id = await Employee.filter(empid=empid).first().values_list("id", flat=True)
+        if employee_id is not None:
+            employee_id_cache.set(empid, employee_id)
+    return employee_id
+
+async def resolve_employee_ids(empids):
+    # empid -> pk for many empids; cache misses are resolved in one query
+    resolved = {}
+    missing = []
+    for empid in empids:
+        employee_id = employee_id_cache.get(empid)
+        if employee_id is None:
+            missing.append(empid)
+        else:
+            resolved[empid] = employee_id
+    if missing:
+        for empid, employee_id in await Employee.filter(empid__in=missing).values_list("empid", "id"):
+            employee_id_cache.set(empid, employee_id)
+            resolved[empid] = employee_id
+    return resolved
+
+def invalidate_employee(*empids):
+    # Forget cached lookups and sessions for these empids
+    for empid in empids:
+        employee_id_cache.pop(empid)
+    identity_cache.discard_where(lambda identity: identity.get("empid") in empids)
+
+async def resolve_identity(request:Request):
+    # Decode the access token once and resolve it to an admin or an employee
+    # from its claims. Results are cached per token for AUTH_CACHE_TTL seconds.
     token = request.cookies.get("access_token")
     if not token:
         raise HTTPException(status_code=401, detail="Unauthorised")
 
+    identity = identity_cache.get(token)
+    if identity:
+        return identity
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid token ppayload")
-        user = await Admin.get_or_none(username=username)
-        if not user:
-            raise HTTPException(status_code=401, detail="Invalid username in token")
-        return username
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+    username = payload.get("sub")
+    empid = payload.get("empid")
+    if username is not None:
+        if not await Admin.exists(username=username):
+            raise HTTPException(status_code=401, detail="Invalid username in token")
+        identity = {"type": "admin", "username": username}
+    elif empid is not None:
+        if not await Employee.exists(empid=empid):
+            raise HTTPException(status_code=401,detail="Invalid empid in token")
+        identity = {"type": "employee", "empid": empid}
+    else:
+        raise HTTPException(status_code=401, detail="Invalid token payload")
+
+    # Never cache past the token's own expiry
+    ttl = AUTH_CACHE_TTL
+    if payload.get("exp"):
+        ttl = min(ttl, payload["exp"] - datetime.now(timezone.utc).timestamp())
+    if ttl > 0:
+        identity_cache.set(token, identity, ttl)
+    return identity
+
+async def authenticate_user(request:Request):
+    identity = await resolve_identity(request)
+    if identity["type"] != "admin":
+        raise HTTPException(status_code=401, detail="Invalid token payload")
+    return identity["username"]
+
 async def authenticate_employee(request:Request):
-    time.sleep(0.5)  # Simulate some processing delay
-    token = request.cookies.get("access_token")
-    if not token:
-        raise HTTPException(status_code=401, detail="Unauthorised")
+    identity = await resolve_identity(request)
+    if identity["type"] != "employee":
+        raise HTTPException(status_code=401, detail="Invalid token payload")
+    return identity["empid"]
 
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        empid = payload.get("empid")
-        if empid is None:
-            raise HTTPException(status_code=401, detail="Invalid token payload")
-        employee = await Employee.get_or_none(empid=empid)
-        if not employee:
-            raise HTTPException(status_code=401,detail="Invalid empid in token")
-        return empid
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+def invalidate_admin(username: str):
+    identity_cache.discard_where(lambda identity: identity == {"type": "admin", "username": username})
     
-def is_rtsp_stream_accessible(url):
-    cap = cv2.VideoCapture(url)
-    if not cap.isOpened():
-        return False
-    ret, frame = cap.read()
-    cap.release()
-    return ret
-
 def is_valid_rtsp_url(url):
     pattern = re.compile(r'^rtsp://(?:[^\s:@]+(?::[^\s:@]*)?@)?[^\s:/?#]+(?::\d+)?(?:/[^\s]*)?$')
     return bool(pattern.match(url))
-
-def generate_frames(rtsp_url: str):
-    cap = cv2.VideoCapture(rtsp_url)
-    if not cap.isOpened():
-        print(f"Error: Cannot open stream {rtsp_url}")
-        return
-    while True:
-        success, frame = cap.read()
-        if not success:
-            break
-        _, buffer = cv2.imencode('.jpg', frame)
-        frame = buffer.tobytes()
-        yield (
-            b'--frame\r\n'
-            b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n'
-        )
-    cap.release()
-
-
@@ -25,7 +25,17 @@ export const stopModel = createAsyncThunk('model/stop', async (_, thunkAPI) => {
 export const generateEmbeddings = createAsyncThunk('model/embeddings', async (_, thunkAPI) => {
   try {
     const res = await axios.post(`${API_URL}/model/generate-embeddings`, {}, { withCredentials: true });
-    return res.data.logs || ['Embeddings generated.'];
+    // Generation runs as a background job on the server, poll it until it finishes
+    for (;;) {
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+      const job = await axios.get(`${API_URL}/model/jobs/${res.data.job_id}?lines=500`, { withCredentials: true });
+      if (job.data.state === 'succeeded') {
+        return job.data.logs.length ? job.data.logs : ['Embeddings generated.'];
+      }
+      if (job.data.state === 'failed') {
+        return thunkAPI.rejectWithValue(job.data.error);
+      }
+    }
   } catch (error) {
     return thunkAPI.rejectWithValue(error.response?.data?.detail || error.message);
   }